@@ -0,0 +1,1304 @@
+# bench_ema_john.py - headless benchmarks for ema_john (no Flet window needed)
+#
+#   python bench_ema_john.py render [--sizes 1000 10000 100000]
+#   python bench_ema_john.py search [--size 100000]
+#   python bench_ema_john.py sort [--size 100000]
+#   python bench_ema_john.py store [--size 100000]
+#   python bench_ema_john.py cache [--size 100000] [--latency-ms 200]
+#   python bench_ema_john.py firstpaint [--sizes 1000 100000] [--latency-ms 200]
+#   python bench_ema_john.py ingest [--mb 500]
+#   python bench_ema_john.py diff [--cart 50]
+#   python bench_ema_john.py resize [--events 200]
+#   python bench_ema_john.py images [--count 200]
+#   python bench_ema_john.py sessions [--sessions 300] [--size 10000]
+#   python bench_ema_john.py refresh [--size 100000] [--changes 500]
+#   python bench_ema_john.py orders [--orders 20000]
+#   python bench_ema_john.py startup [--sizes 1000 100000] [--runs 5]
+#   python bench_ema_john.py suite [--sizes 1000 10000 100000 1000000] [--save [FILE]] [--baseline FILE] [--profile]
+#
+# `suite` is the regression run: latency percentiles, allocations and control
+# counts for each hot path, optionally compared against a saved baseline
+# (bench_baseline.json next to this file by default).
+import argparse
+import asyncio
+import http.server
+import io
+import json
+import os
+import py_compile
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import tracemalloc
+
+import flet as ft
+from flet.core.protocol import CommandEncoder
+
+import ema_john
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakePage:
+    """Just enough of ft.Page for main(page) to run without a window.
+
+    Updates go through Flet's own diffing (build_update_commands), so
+    `payload_bytes` is the JSON a real session would send to the client.
+    """
+
+    def __init__(self, width=1000, height=800):
+        self.root = ft.Column()
+        self.root._Control__uid = "page"
+        self._index = {"page": self}
+        self._next_uid = 0
+        self.width = width
+        self.height = height
+        self.snack_bar = None
+        self.updates = 0
+        self.payload_bytes = 0
+        self.probe = None  # called after every update(), e.g. to timestamp the first card
+        # where ft.Page keeps its connection; instrumentation hooks send_commands
+        self._Page__conn = types.SimpleNamespace(send_commands=self._send_commands)
+
+    @property
+    def controls(self):
+        return self.root.controls
+
+    def add(self, *controls):
+        self.root.controls.extend(controls)
+        self.update()
+
+    def update(self, *controls):
+        self.updates += 1
+        commands, added, removed = [], [], []
+        for c in controls or (self.root,):
+            c.build_update_commands(self._index, commands, added, removed)
+        for c in added:
+            self._next_uid += 1
+            c._Control__uid = f"_{self._next_uid}"
+            self._index[c._Control__uid] = c
+        for c in removed:
+            c.page = None
+        self._Page__conn.send_commands("", commands)
+        if self.probe:
+            self.probe(self)
+
+    def _send_commands(self, session_id, commands):
+        self.payload_bytes += len(json.dumps(commands, cls=CommandEncoder))
+        return types.SimpleNamespace(results=[])
+
+    def run_task(self, handler, *args):
+        # ft.Page schedules this on its event loop; here it just runs to completion
+        return asyncio.run(handler(*args))
+
+
+def synthetic_catalog(n, source=os.path.join(HERE, "products.json")):
+    """`n` products shaped like the bundled products.json (ids made unique)."""
+    with open(source, encoding="utf-8") as f:
+        base = json.load(f)
+    out = []
+    for i in range(n):
+        p = dict(base[i % len(base)])
+        p["id"] = f"{p['id']}-{i}"
+        p["name"] = f"{p['name']} {i}"
+        p["price"] = round(p["price"] * (0.5 + (i * 7919 % 1000) / 1000), 2)
+        out.append(p)
+    return out
+
+
+def normalized_catalog(n):
+    # same shape safe_load_products returns
+    raw = synthetic_catalog(n)
+    return [{
+        "id": str(p["id"]), "name": p["name"], "price": float(p["price"]),
+        "img": p.get("img", ""), "category": p.get("category", ""),
+        "seller": p.get("seller", ""), "stock": int(p.get("stock", 0)),
+        "ratings": float(p.get("ratings", 0)), "ratingsCount": int(p.get("ratingsCount", 0)),
+        "shipping": float(p.get("shipping", 0)),
+    } for p in raw]
+
+
+def iter_controls(root):
+    stack = list(root) if isinstance(root, list) else [root]
+    while stack:
+        c = stack.pop()
+        yield c
+        stack.extend(c._get_children())
+
+
+def count_controls(root):
+    return sum(1 for _ in iter_controls(root))
+
+
+def find_control(root, pred):
+    for c in iter_controls(root):
+        if pred(c):
+            return c
+    return None
+
+
+def start_app(products, width=1000, height=800, images=False, orders_db=":memory:"):
+    """Run main() on a FakePage with `products` as the catalog.
+
+    Search debouncing, async loading, the periodic refresh and the disk
+    caches are switched off (the image cache unless `images`; orders go to
+    `orders_db`, in memory by default) so handlers render synchronously and
+    nothing outside `products` is loaded or written.
+    """
+    ema_john.SEARCH_DEBOUNCE_MS = 0
+    ema_john.ASYNC_CATALOG_LOAD = False
+    ema_john.CATALOG_CACHE = False
+    ema_john.IMAGE_CACHE = images
+    ema_john.CATALOG_REFRESH_S = 0
+    ema_john.ORDERS_DB = orders_db
+    loader = ema_john.safe_load_products
+    ema_john.safe_load_products = lambda *a, **kw: products
+    try:
+        page = FakePage(width, height)
+        ema_john.main(page)
+    finally:
+        ema_john.safe_load_products = loader
+    return page
+
+
+def bench_render(sizes, repeat=3):
+    rows = []
+    for n in sizes:
+        products = normalized_catalog(n)
+        for virtual in (True, False):
+            if not virtual and n > 10000:
+                continue  # eager mode at 100k takes minutes and GBs
+            ema_john.VIRTUAL_LIST = virtual
+            page = start_app(products)
+            search = find_control(page.controls, lambda c: isinstance(c, ft.TextField))
+            listview = find_control(
+                page.controls, lambda c: isinstance(c, ft.ListView) and c.spacing == 10)
+            timings = []
+            peak = 0
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                search.on_change(None)
+                timings.append(time.perf_counter() - t0)
+                peak = max(peak, count_controls(listview))
+            rows.append((n, "virtual" if virtual else "eager", min(timings) * 1000, peak))
+    ema_john.VIRTUAL_LIST = True
+    print(f"{'products':>10} {'mode':>8} {'render ms':>10} {'controls':>10}")
+    for n, mode, ms, peak in rows:
+        print(f"{n:>10} {mode:>8} {ms:>10.2f} {peak:>10}")
+    return rows
+
+
+def linear_scan(products, q):
+    # the search box's original filter: substring scan, lowercasing every product per query
+    q = q.strip().lower()
+    return [p for p in products if (q in p["name"].lower() or q in p.get(
+        "category", "").lower())]
+
+
+SEARCH_QUERIES = ["u", "ul", "ult", "ultra", "ultraboost", "shoes", "men s sneaker",
+                  "cap", "addidas", "pants red", "zzz"]
+
+
+def bench_search(size, repeat=5):
+    products = normalized_catalog(size)
+    t0 = time.perf_counter()
+    index = ema_john.SearchIndex(products)
+    build_ms = (time.perf_counter() - t0) * 1000
+    print(f"{size} products, index built in {build_ms:.0f} ms")
+    print(f"{'query':>16} {'scan ms':>9} {'hits':>7} {'index ms':>9} {'hits':>7}")
+    for q in SEARCH_QUERIES:
+        scan = idx = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            scan_hits = linear_scan(products, q)
+            scan = min(scan, time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            idx_hits = index.search(q)
+            idx = min(idx, time.perf_counter() - t0)
+        print(f"{q!r:>16} {scan * 1000:>9.2f} {len(scan_hits):>7} {idx * 1000:>9.2f} {len(idx_hits):>7}")
+
+
+def resort(products, index, q, sort_val):
+    # the original filter_and_sort: search, then sort the hits from scratch
+    filtered = index.search(q) if q else products.copy()
+    key = ema_john.SORT_KEYS.get(sort_val)
+    if key:
+        filtered.sort(key=key)
+    return filtered
+
+
+def bench_sort(size, repeat=5):
+    products = normalized_catalog(size)
+    index = ema_john.SearchIndex(products)
+    t0 = time.perf_counter()
+    engine = ema_john.FilterSortEngine(products, index)
+    print(f"{size} products, sort orders precomputed in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    def best(fn):
+        t = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            t = min(t, time.perf_counter() - t0)
+        return t * 1000
+
+    print("sort change")
+    print(f"{'query':>12} {'sort':>20} {'resort ms':>10} {'engine ms':>10}")
+    for q in ("", "shoes", "pants red"):
+        for sort_val in ema_john.SORT_KEYS:
+            old = best(lambda: resort(products, index, q, sort_val))
+            # the engine's hit list for q is cached by the previous call, like a real sort change
+            engine.query(q, "Relevance")
+            new = best(lambda: engine.query(q, sort_val))
+            print(f"{q!r:>12} {sort_val:>20} {old:>10.2f} {new:>10.2f}")
+
+    print("typing a query, one keystroke at a time")
+    print(f"{'query':>12} {'hits':>7} {'index ms':>9} {'narrowed ms':>12}")
+    typed = "ultraboost shoes"
+    for i in range(1, len(typed) + 1):
+        q = typed[:i]
+        full = best(lambda: index.search_ids(q))
+        engine.query(typed[:i - 1], "Relevance")
+        prev_ids = engine._last_ids
+        narrowed = best(lambda: index.search_ids(q, within=prev_ids) if prev_ids is not None
+                        else index.search_ids(q))
+        hits = len(engine.query(q, "Relevance"))
+        print(f"{q!r:>12} {hits:>7} {full:>9.2f} {narrowed:>12.2f}")
+
+
+def traced(build):
+    """(result, bytes allocated and still held) for build()."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, held
+
+
+def bench_store(size, repeat=5):
+    source = normalized_catalog(size)
+
+    def catalog(products):
+        # what a session holds: the products plus the search index and engine over them
+        return ema_john.FilterSortEngine(products, ema_john.SearchIndex(products))
+
+    dicts, dict_bytes = traced(lambda: [dict(p) for p in source])
+    store, store_bytes = traced(lambda: ema_john.ProductStore(source))
+    rows = list(store)
+    _, dict_catalog_bytes = traced(lambda: catalog([dict(p) for p in source]))
+    engine, store_catalog_bytes = traced(lambda: catalog(ema_john.ProductStore(source)))
+    # the index and the engine hold the store's own row views, not copies
+    assert engine.index._products[0] is engine.get(engine.products[0]["id"]) is engine.products[0]
+    print(f"{size} products")
+    print(f"{'':>24} {'MB':>8}")
+    print(f"{'list of dicts':>24} {dict_bytes / 1e6:>8.1f}")
+    print(f"{'store (with row views)':>24} {store_bytes / 1e6:>8.1f}")
+    print(f"{'dicts + index + engine':>24} {dict_catalog_bytes / 1e6:>8.1f}")
+    print(f"{'store + index + engine':>24} {store_catalog_bytes / 1e6:>8.1f}")
+
+    def best(fn):
+        t = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            t = min(t, time.perf_counter() - t0)
+        return t * 1000
+
+    def by_columns(s):
+        order = range(len(s))
+        for field, descending in reversed(ema_john.SORT_COLUMNS["Top Rated"]):
+            order = sorted(order, key=s.column(field).__getitem__, reverse=descending)
+        return s.rows_at(order)
+
+    print(f"{'lookup':>24} {'dicts ms':>9} {'rows ms':>9} {'columns ms':>11}")
+    lookups = {
+        'p["price"]': (lambda ps: sum(p["price"] for p in ps), lambda s: sum(s.column("price"))),
+        'p.get("seller", "-")': (lambda ps: [p.get("seller", "-") for p in ps],
+                                 lambda s: [v or "-" for v in s.column("seller")]),
+        'sort by ratings': (lambda ps: sorted(ps, key=ema_john.SORT_KEYS["Top Rated"]), by_columns),
+    }
+    for name, (fn, column_fn) in lookups.items():
+        print(f"{name:>24} {best(lambda: fn(dicts)):>9.1f} {best(lambda: fn(rows)):>9.1f}"
+              f" {best(lambda: column_fn(store)):>11.1f}")
+
+
+class CatalogServer:
+    """Local HTTP stand-in for PRODUCTS_JSON_URL with ETag/Last-Modified support."""
+
+    def __init__(self, body, latency_ms=0):
+        self.body = body
+        self.etag = '"v1"'
+        self.last_modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+        self.latency = latency_ms / 1000
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(server.latency)
+                server.requests.append(self.path)
+                if self.headers.get("If-None-Match") == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(server.body)))
+                self.send_header("ETag", server.etag)
+                self.send_header("Last-Modified", server.last_modified)
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/products.json"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def set_body(self, body, etag):
+        self.body, self.etag = body, etag
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def bench_cache(size, latency_ms=200):
+    body = json.dumps(synthetic_catalog(size)).encode()
+    server = CatalogServer(body, latency_ms)
+    print(f"{size} products, {len(body) / 1e6:.1f} MB JSON, {latency_ms} ms simulated latency")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ema_john.CatalogCache(tmp)
+
+            def timed(label, fn):
+                t0 = time.perf_counter()
+                result = fn()
+                ms = (time.perf_counter() - t0) * 1000
+                n = "unchanged" if result is None else f"{len(result)} products"
+                print(f"{label:>34} {ms:>9.1f} ms  ({n})")
+
+            timed("cold start (fetch + parse + cache)",
+                  lambda: ema_john.safe_load_products(server.url, cache=cache))
+            timed("warm start (cache only)", cache.load)
+            timed("background revalidation (304)",
+                  lambda: ema_john.fetch_catalog(server.url, cache))
+            server.set_body(body, '"v2"')
+            timed("background revalidation (200)",
+                  lambda: ema_john.fetch_catalog(server.url, cache))
+            server.close()
+            timed("offline start (server down)",
+                  lambda: ema_john.safe_load_products(server.url, cache=cache, timeout=1))
+    finally:
+        server.httpd.server_close()
+
+
+def product_list(page):
+    return find_control(page.controls, lambda c: isinstance(c, ft.ListView) and c.spacing == 10)
+
+
+def has_card(page):
+    # the virtual list always holds its two spacers
+    lv = product_list(page)
+    return lv is not None and any(isinstance(c.data, dict) for c in lv.controls)
+
+
+def bench_firstpaint(sizes, latency_ms=200):
+    print(f"{latency_ms} ms simulated catalog latency")
+    print(f"{'products':>10} {'mode':>6} {'first paint ms':>15} {'first card ms':>14} {'loaded ms':>10}")
+    for n in sizes:
+        server = CatalogServer(json.dumps(synthetic_catalog(n)).encode(), latency_ms)
+        try:
+            for mode in ("sync", "async"):
+                ema_john.SEARCH_DEBOUNCE_MS = 0
+                ema_john.CATALOG_CACHE = False
+                ema_john.IMAGE_CACHE = False
+                ema_john.CATALOG_REFRESH_S = 0
+                ema_john.CATALOG_SOURCE = server.url
+                ema_john.ASYNC_CATALOG_LOAD = mode == "async"
+                marks = {}
+                page = FakePage()
+
+                def probe(page):
+                    now = time.perf_counter() - t0
+                    marks.setdefault("paint", now)
+                    if "card" not in marks and has_card(page):
+                        marks["card"] = now
+
+                page.probe = probe
+                t0 = time.perf_counter()
+                ema_john.main(page)
+                loaded = time.perf_counter() - t0
+                print(f"{n:>10} {mode:>6} {marks['paint'] * 1000:>15.1f} "
+                      f"{marks.get('card', loaded) * 1000:>14.1f} {loaded * 1000:>10.1f}")
+        finally:
+            server.close()
+    ema_john.CATALOG_SOURCE = ema_john.PRODUCTS_JSON_URL
+    ema_john.ASYNC_CATALOG_LOAD = True
+
+
+class Click:
+    """Stand-in for the ControlEvent a button click delivers."""
+
+    def __init__(self, control):
+        self.control = control
+
+
+def measure(page, action):
+    """(controls created, update payload bytes) caused by action()."""
+    before = {id(c) for c in iter_controls(page.controls)}
+    sent = page.payload_bytes
+    action()
+    created = sum(1 for c in iter_controls(page.controls) if id(c) not in before)
+    return created, page.payload_bytes - sent
+
+
+def bench_diff(cart_lines=50, size=1000):
+    products = normalized_catalog(size)
+    print(f"{cart_lines} cart lines, {size} products")
+    print(f"{'action':>18} {'mode':>8} {'created':>8} {'payload bytes':>14} {'ms':>8}")
+    for keyed in (True, False):
+        ema_john.KEYED_RENDER = keyed
+        page = start_app(products)
+        lv = product_list(page)
+        vlist = lv.on_scroll.__self__
+        add_button = find_control(lv, lambda c: isinstance(c, ft.ElevatedButton))
+        t0 = time.perf_counter()
+        for p in products[:cart_lines]:
+            # the handler reads the product from the clicked button
+            add_button.on_click(Click(types.SimpleNamespace(data=p)))
+        fill_ms = (time.perf_counter() - t0) * 1000
+        cart_lv = find_control(page.controls, lambda c: isinstance(c, ft.ListView) and c.spacing == 6)
+        plus = find_control(cart_lv.controls[0], lambda c: isinstance(c, ft.IconButton)
+                            and c.icon == ft.Icons.ADD)
+        search = find_control(page.controls, lambda c: isinstance(c, ft.TextField))
+
+        def scroll():
+            vlist.scroll_to(vlist.item_height * (vlist.overscan + 1))
+            lv.update()
+
+        mode = "keyed" if keyed else "rebuild"
+        print(f"{'fill cart':>18} {mode:>8} {'':>8} {'':>14} {fill_ms:>8.1f}")
+        for label, action in (("cart +1", lambda: plus.on_click(Click(plus))),
+                              ("scroll one card", scroll),
+                              ("search re-render", lambda: search.on_change(None))):
+            took = []
+
+            def timed(action=action):
+                t0 = time.perf_counter()
+                action()
+                took.append((time.perf_counter() - t0) * 1000)
+
+            created, sent = measure(page, timed)
+            ms = took[0]
+            print(f"{label:>18} {mode:>8} {created:>8} {sent:>14} {ms:>8.2f}")
+    ema_john.KEYED_RENDER = True
+
+
+def bench_resize(events=200, size=10000):
+    """Drag the window across the mobile breakpoint and count what each burst costs."""
+    products = normalized_catalog(size)
+    print(f"{events} resize events, 1200px -> 400px -> 1200px, {size} products")
+    print(f"{'throttle ms':>12} {'updates':>8} {'created':>8} {'payload bytes':>14} {'ms':>8}")
+    for throttle_ms in (0, ema_john.RESIZE_THROTTLE_MS):
+        ema_john.RESIZE_THROTTLE_MS = throttle_ms
+        page = start_app(products, width=1200)
+        widths = [int(1200 - 800 * abs(1 - 2 * i / (events - 1))) for i in range(events)]
+
+        def drag():
+            for w in widths:
+                h = 600 + w // 2  # diagonal drag: the list's viewport changes too
+                page.width = w
+                page.height = h
+                page.on_resized(types.SimpleNamespace(width=w, height=h))
+                time.sleep(0.002)  # ~500 events/s, roughly a fast window drag
+            time.sleep(throttle_ms / 1000 + 0.05)  # let the trailing call land
+
+        updates = page.updates
+        t0 = time.perf_counter()
+        created, sent = measure(page, drag)
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"{throttle_ms:>12} {page.updates - updates:>8} {created:>8} {sent:>14} {ms:>8.0f}")
+    ema_john.RESIZE_THROTTLE_MS = 100
+
+
+class ImageServer:
+    """Local HTTP stand-in for the product image CDN: /<n>.jpg, full size."""
+
+    def __init__(self, count, size=840):
+        from PIL import Image
+
+        self.images = {}
+        for n in range(count):
+            im = Image.effect_noise((size, size), 40 + n % 60).convert("RGB")
+            out = tempfile.SpooledTemporaryFile()
+            im.save(out, "JPEG", quality=90)
+            out.seek(0)
+            self.images[f"/{n}.jpg"] = out.read()
+        self.requests = 0
+        self.bytes_sent = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = server.images.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                server.requests += 1
+                server.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def bench_images(count=200):
+    server = ImageServer(count)
+    products = normalized_catalog(count)
+    for n, p in enumerate(products):
+        p["img"] = f"{server.url}/{n}.jpg"
+    full = sum(map(len, server.images.values())) / count
+    print(f"{count} products, 840px JPEGs averaging {full / 1e3:.0f} KB")
+    caches = []
+    factory = ema_john.ImageCache
+    ema_john.ImageCache = lambda *a, **kw: caches.append(factory(*a, **kw)) or caches[-1]
+
+    def local(lv):
+        images = [c.data["image"] for c in lv.controls if isinstance(c.data, dict)]
+        return sum(1 for im in images if not im.src.startswith("http")), len(images)
+
+    def settle(cache):
+        while cache.stats()["pending"]:
+            time.sleep(0.01)
+        time.sleep(ema_john.IMAGE_REFRESH_MS / 1000 + 0.05)  # trailing swap-in
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            ema_john.IMAGE_CACHE_DIR = tmp
+            for session in ("cold", "warm"):
+                sent = server.bytes_sent
+                t0 = time.perf_counter()
+                page = start_app(products, images=True)
+                lv = product_list(page)
+                vlist = lv.on_scroll.__self__
+                shown, visible = local(lv)
+                settle(caches[-1])
+                ms = (time.perf_counter() - t0) * 1000
+                print(f"{session:>5} start: {shown}/{visible} cards local at first paint, "
+                      f"all cached after {ms:.0f} ms, {(server.bytes_sent - sent) / 1e6:.1f} MB downloaded")
+                vlist.scroll_to(vlist.item_height * vlist.page_size / 2)
+                shown, visible = local(lv)
+                print(f"{'':>5} scroll half a page: {shown}/{visible} cards local (prefetched)")
+                settle(caches[-1])
+                stats = caches[-1].stats()
+                thumbs = [n for n in os.listdir(tmp) if not n.endswith("_0")]
+                thumb_kb = sum(os.path.getsize(os.path.join(tmp, n)) for n in thumbs) / max(1, len(thumbs)) / 1e3
+                print(f"{'':>5} {stats['downloads']} downloads, {len(thumbs)} thumbnails "
+                      f"averaging {thumb_kb:.0f} KB (vs {full / 1e3:.0f} KB full size)")
+                caches[-1].close()
+            cap = int(full * 20)
+            capped = factory(tmp, max_bytes=cap)
+            capped.prefetch([p["img"] for p in products], 120)
+            settle(capped)
+            print(f"cache capped at {cap / 1e6:.1f} MB: {capped.stats()['files']} files, "
+                  f"{capped.stats()['bytes'] / 1e6:.1f} MB on disk")
+            capped.close()
+    finally:
+        ema_john.ImageCache = factory
+        server.close()
+
+
+def write_synthetic_file(path, mb=None, count=None):
+    """Stream a products.json-shaped array of roughly `mb` megabytes (or `count` products) to `path`."""
+    base = synthetic_catalog(1000)
+    target = mb * 1_000_000 if mb else float("inf")
+    count = count or float("inf")
+    written = n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        while written < target and n < count:
+            p = dict(base[n % len(base)], id=f"p-{n}", name=f"{base[n % len(base)]['name']} {n}")
+            chunk = ("," if n else "") + json.dumps(p)
+            f.write(chunk)
+            written += len(chunk)
+            n += 1
+        f.write("]")
+    return n
+
+
+INGEST_MODES = {
+    # the original safe_load_products: whole body, decoded text, parsed list, cleaned list
+    "read+loads": lambda f: [ema_john.normalize_product(p, i)
+                             for i, p in enumerate(json.loads(f.read().decode()))],
+    "stream (discard)": lambda f: sum(1 for _ in ema_john.iter_products(f)),
+    "stream -> list": lambda f: list(ema_john.iter_products(f)),
+    "stream -> store": lambda f: ema_john.ProductStore(ema_john.iter_products(f)),
+}
+
+
+def ingest_worker(mode, path):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    with open(path, "rb") as f:
+        INGEST_MODES[mode](f)
+    elapsed = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+    print(json.dumps({"baseline_mb": before / 1024, "peak_mb": peak / 1024, "s": elapsed}))
+
+
+def bench_ingest(mb):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.json")
+        n = write_synthetic_file(path, mb)
+        print(f"{os.path.getsize(path) / 1e6:.0f} MB catalog, {n} products; one process per mode")
+        print(f"{'mode':>18} {'peak RSS MB':>12} {'over baseline':>14} {'seconds':>8}")
+        for mode in INGEST_MODES:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "_ingest", mode, path],
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{mode:>18} failed: {proc.stderr.strip().splitlines()[-1:]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{mode:>18} {r['peak_mb']:>12.0f} {r['peak_mb'] - r['baseline_mb']:>14.0f} {r['s']:>8.1f}")
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def bench_sessions(sessions=300, size=10000, per_session_cap=20):
+    """Many simulated browser sessions in one process: server mode vs. a catalog per session."""
+    import gc
+
+    products = normalized_catalog(size)
+    print(f"{size} products; per-session mode is capped at {per_session_cap} sessions")
+    print(f"{'mode':>12} {'sessions':>9} {'catalog ms':>11} {'start p50':>10} {'start p95':>10} {'MB/session':>11}")
+    for server in (True, False):
+        n = sessions if server else min(sessions, per_session_cap)
+        ema_john.SERVER_MODE = server
+        ema_john._shared.clear()
+        gc.collect()
+        base = rss_mb()
+        load_ms = 0
+        if server:
+            shared = ema_john._shared["catalog"] = ema_john.SharedCatalog(loader=lambda: products)
+            t0 = time.perf_counter()
+            shared.get()
+            load_ms = (time.perf_counter() - t0) * 1000
+            gc.collect()
+            base = rss_mb()
+        pages, times = [], []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            pages.append(start_app(products))
+            times.append((time.perf_counter() - t0) * 1000)
+        gc.collect()
+        per = (rss_mb() - base) / n
+        mode = "server" if server else "per-session"
+        print(f"{mode:>12} {n:>9} {load_ms:>11.0f} {percentile(times, 50):>10.1f} "
+              f"{percentile(times, 95):>10.1f} {per:>11.2f}")
+        if server:
+            # sessions share the catalog, not their state
+            a, b = pages[0], pages[1]
+
+            def first_card(page):
+                return next(c for c in product_list(page).controls if isinstance(c.data, dict)).data["name"].value
+
+            before = first_card(b)
+            search = find_control(a.controls, lambda c: isinstance(c, ft.TextField))
+            search.value = "bag"
+            search.on_change(None)
+            add = find_control(product_list(a), lambda c: isinstance(c, ft.ElevatedButton))
+            add.on_click(Click(add))
+            assert first_card(a) != before and first_card(b) == before, "query leaked across sessions"
+            cart_b = find_control(b.controls, lambda c: isinstance(c, ft.ListView) and c.spacing == 6)
+            assert not isinstance(cart_b.controls[0].data, dict), "cart leaked across sessions"
+            t0 = time.perf_counter()
+            snapshot = shared.replace(products[: size // 2])
+            swap_ms = (time.perf_counter() - t0) * 1000
+            counts = {find_control(p.controls, lambda c: isinstance(c, ft.Text) and str(c.value).endswith(" items")).value
+                      for p in pages}
+            print(f"{'':>12} refresh to v{snapshot.version} ({size // 2} products): {swap_ms:.0f} ms to build, "
+                  f"publish and re-render {shared.sessions} sessions; they now show {sorted(counts)}")
+        for p in pages:
+            p.on_close(None)
+        del pages
+    ema_john.SERVER_MODE = False
+    ema_john._shared.clear()
+
+
+def changed_catalog(raw, changes, cart_ids):
+    """`raw` with `changes` price/stock/rating edits, a few products dropped and added.
+
+    Products in `cart_ids` go down to 1 in stock, except the first, which is removed.
+    """
+    out = [dict(p) for p in raw]
+    step = max(1, len(out) // max(1, changes))
+    for i in range(0, len(out), step)[:changes]:
+        p = out[i]
+        kind = i // step % 3
+        if kind == 0:
+            # the next product's price: ties it with a product that comes later in the catalog
+            p["price"] = out[(i + 1) % len(out)]["price"]
+        elif kind == 1:
+            p["stock"] = max(0, p.get("stock", 0) - 5)
+        else:
+            p["ratings"], p["ratingsCount"] = 4.9, p.get("ratingsCount", 0) + 1
+    gone = {cart_ids[0]}
+    gone.update(p["id"] for p in out[-changes // 10:])
+    for p in out:
+        if p["id"] in cart_ids:
+            p["stock"] = 1
+    added = [dict(p, id=f"{p['id']}-new", name=f"{p['name']} (new)") for p in out[:changes // 10]]
+    return [p for p in out if p["id"] not in gone] + added
+
+
+def bench_refresh(size=100000, changes=500, cart_lines=20):
+    """A periodic refresh with a small delta: patched in place vs. a full rebuild."""
+    raw = synthetic_catalog(size)
+    new_raw = changed_catalog(raw, changes, [p["id"] for p in raw[:cart_lines]])
+    server = CatalogServer(json.dumps(raw).encode())
+    print(f"{size} products; refresh with {changes} price/stock/rating changes, "
+          f"{changes // 10} added, {changes // 10 + 1} removed, {cart_lines} cart lines")
+    print(f"{'mode':>8} {'fetch ms':>9} {'apply ms':>9} {'created':>8} {'payload bytes':>14} {'cart after':>22}")
+    refreshers = []
+    factory = ema_john.CatalogRefresher
+    ema_john.CatalogRefresher = lambda *a, **kw: refreshers.append(factory(*a, **kw)) or refreshers[-1]
+    fraction = ema_john.DELTA_REBUILD_FRACTION
+    results = {}
+    try:
+        for mode, share in (("delta", fraction), ("rebuild", 0)):
+            ema_john.DELTA_REBUILD_FRACTION = share
+            server.set_body(json.dumps(raw).encode(), '"v1"')
+            page = start_app(normalized_catalog(size))
+            refresher = refreshers[-1]
+            refresher.source = server.url
+            apply, applied = refresher.on_update, []
+
+            def timed_apply(products):
+                t0 = time.perf_counter()
+                apply(products)
+                applied.append((time.perf_counter() - t0) * 1000)
+
+            refresher.on_update = timed_apply
+            lv = product_list(page)
+            add = find_control(lv, lambda c: isinstance(c, ft.ElevatedButton))
+            for p in normalized_catalog(cart_lines):
+                for _ in range(2):
+                    add.on_click(Click(types.SimpleNamespace(data=p)))
+            search = find_control(page.controls, lambda c: isinstance(c, ft.TextField))
+            search.value = "shoe"
+            search.on_change(None)
+            server.set_body(json.dumps(new_raw).encode(), '"v2"')
+            t0 = time.perf_counter()
+            created, sent = measure(page, refresher.run_once)
+            fetch_ms = (time.perf_counter() - t0) * 1000 - applied[0]
+            cart_lv = find_control(page.controls, lambda c: isinstance(c, ft.ListView) and c.spacing == 6)
+            qty = [int(c.data["qty"].value) for c in cart_lv.controls if isinstance(c.data, dict)]
+            cart = f"{len(qty)} lines, {sum(qty)} units"
+            seen = results[mode] = {"window": [c.data["name"].value for c in lv.controls
+                                               if isinstance(c.data, dict)]}
+            print(f"{mode:>8} {fetch_ms:>9.1f} {applied[0]:>9.1f} {created:>8} {sent:>14} {cart:>22}")
+            # the whole catalog in every sort order, not just the visible window (ties included)
+            vlist = lv.on_scroll.__self__
+            sort = find_control(page.controls, lambda c: isinstance(c, ft.Dropdown))
+            search.value = ""
+            for name in ema_john.SORT_KEYS:
+                sort.value = name
+                sort.on_change(None)
+                seen[name] = [p["id"] for p in vlist.items]
+            page.on_close(None)
+        differ = [k for k in results["delta"] if results["delta"][k] != results["rebuild"][k]]
+        assert not differ, f"delta and rebuild disagree: {differ}"
+    finally:
+        ema_john.CatalogRefresher = factory
+        ema_john.DELTA_REBUILD_FRACTION = fraction
+        server.close()
+
+
+def fill_orders(store, customer, count, products, batch=None):
+    """`count` checkouts of 1-5 random lines each; flushed every `batch` orders (None: per order)."""
+    rng = random.Random(count)
+    for n in range(count):
+        cart = ema_john.Cart()
+        for p in rng.sample(products, rng.randint(1, 5)):
+            cart.add(p, rng.randint(1, 3))
+        store.place(customer, cart)
+        if batch is None or (n + 1) % batch == 0:
+            store.flush()
+    store.flush()
+
+
+def bench_orders(count=20000, page_size=None):
+    """Order history: write batching, then page loads at the start, middle and end of the history."""
+    page_size = page_size or ema_john.ORDERS_PAGE_SIZE
+    products = normalized_catalog(200)
+
+    def best(fn, repeat):
+        t = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            t = min(t, time.perf_counter() - t0)
+        return t * 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{count} orders for one customer, {page_size} per page")
+        print(f"{'writes':>26} {'orders/s':>10} {'transactions':>13}")
+        for label, batch in (("one transaction per order", None), ("batched (100)", 100)):
+            store = ema_john.OrderStore(os.path.join(tmp, f"{batch}.sqlite3"))
+            n = min(count, 2000)
+            t0 = time.perf_counter()
+            fill_orders(store, "bench", n, products, batch)
+            rate = n / (time.perf_counter() - t0)
+            print(f"{label:>26} {rate:>10.0f} {store.flushes:>13}")
+            store.close()
+
+        path = os.path.join(tmp, "orders.sqlite3")
+        store = ema_john.OrderStore(path)
+        fill_orders(store, "local", count, products, batch=500)
+        fill_orders(store, "someone else", count // 4, products, batch=500)
+
+        def materialize_all(sort):
+            # what rendering the whole history would need: every order and line, sorted in Python
+            column, descending = ema_john.ORDER_SORTS[sort]
+            rows = store._reader.execute(
+                f"SELECT {', '.join(ema_john.ORDER_COLUMNS)} FROM orders WHERE customer = ?",
+                ("local",)).fetchall()
+            orders = [dict(zip(ema_john.ORDER_COLUMNS, r), lines=[]) for r in rows]
+            store._attach_lines(orders)
+            orders.sort(key=lambda o: (o[column], o["id"]), reverse=descending)
+            return orders[:page_size]
+
+        print(f"\n{'sort':>18} {'page 1 ms':>10} {'middle ms':>10} {'last ms':>8} {'everything ms':>14}")
+        pages = -(-count // page_size)
+        for sort in ema_john.ORDER_SORTS:
+            cursors = [None]  # the order each page starts after, walked once up front
+            result = store.page("local", sort, limit=page_size)
+            while result.has_next:
+                cursors.append(result.orders[-1])
+                result = store.page("local", sort, after=result.orders[-1], limit=page_size)
+            assert len(cursors) == pages, (len(cursors), pages)
+            times = [best(lambda: store.page("local", sort, after=cursors[i], limit=page_size), 5)
+                     for i in (0, pages // 2, pages - 1)]
+            everything = best(lambda: materialize_all(sort), 1)
+            print(f"{sort:>18} {times[0]:>10.2f} {times[1]:>10.2f} {times[2]:>8.2f} {everything:>14.1f}")
+        store.close()
+
+        # the page itself: controls built for the review page and per Next click
+        ema_john.ORDERS_PAGE_SIZE = page_size
+        app = start_app(products, orders_db=path)
+        review = find_control(app.controls, lambda c: isinstance(c, ft.TextButton) and c.text == "Order Review")
+        t0 = time.perf_counter()
+        created, sent = measure(app, lambda: review.on_click(None))
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"\nopen Order Review: {ms:.1f} ms, {created} controls created, {sent} bytes sent")
+        nxt = find_control(app.controls, lambda c: isinstance(c, ft.IconButton) and c.icon == ft.Icons.CHEVRON_RIGHT)
+        t0 = time.perf_counter()
+        created, sent = measure(app, lambda: nxt.on_click(None))
+        ms = (time.perf_counter() - t0) * 1000
+        label = find_control(app.controls, lambda c: isinstance(c, ft.Text) and str(c.value).startswith("Page ")).value
+        print(f"next page:         {ms:.1f} ms, {created} controls created, {sent} bytes sent ({label})")
+        app.on_close(None)
+
+
+# One cold start per fresh interpreter: timestamps from before `import flet` to
+# the first rendered card, printed as JSON. argv: the directory of this file.
+COLD_START_SCRIPT = r"""
+import sys, time
+t0 = time.perf_counter()
+import flet
+t_flet = time.perf_counter()
+import ema_john
+t_import = time.perf_counter()
+loaded = set(sys.modules)
+import json
+sys.path.insert(0, sys.argv[1])
+import bench_ema_john as bench
+harness = set(sys.modules)  # e.g. http.server for the stand-in servers
+
+ema_john.IMAGE_CACHE = False
+ema_john.CATALOG_REFRESH_S = 0
+ema_john.ORDERS_DB = ":memory:"
+marks = {}
+page = bench.FakePage()
+
+def probe(page):
+    now = time.perf_counter()
+    marks.setdefault("paint", now)
+    if "card" not in marks and bench.has_card(page):
+        marks["card"] = now
+        marks["lazy"] = [m for m in bench.LAZY_MODULES
+                         if m in loaded or m in sys.modules and m not in harness]
+
+page.probe = probe
+ema_john.main(page)  # FakePage.run_task streams the whole catalog in before returning
+ms = lambda t: (t - t0) * 1000
+print(json.dumps({"flet_ms": ms(t_flet), "import_ms": ms(t_import) - ms(t_flet),
+                  "paint_ms": ms(marks["paint"]), "card_ms": ms(marks["card"]),
+                  "loaded_ms": ms(time.perf_counter()), "lazy": marks["lazy"]}))
+"""
+# modules ema_john imports on first use only; none of them should be loaded by the first card
+LAZY_MODULES = ("PIL.Image", "sqlite3", "http.server")
+
+
+def cold_start(n, runs, tmp):
+    """`runs` fresh-process starts with a warm catalog cache of `n` products (the usual launch)."""
+    source = os.path.join(tmp, f"catalog-{n}.json")
+    if not os.path.exists(source):
+        write_synthetic_file(source, count=n)
+    cache_dir = os.path.join(tmp, f"cache-{n}")
+    ema_john.fetch_catalog(source, ema_john.CatalogCache(cache_dir))
+    # a real install has bytecode; without it every run would time the compiler
+    py_compile.compile(ema_john.__file__)
+    env = dict(os.environ, EMA_JOHN_CACHE_DIR=cache_dir, EMA_JOHN_PRODUCTS=source,
+               PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT, HERE], env=env, cwd=tmp,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return samples
+
+
+def bench_startup(sizes, runs=5):
+    """Cold start: import time and time to the first rendered card, each in a new process."""
+    print(f"median of {runs} fresh processes per size; ms since before `import flet`")
+    print(f"{'products':>10} {'import flet':>12} {'import ema_john':>16} {'first paint':>12} "
+          f"{'first card':>11} {'card p95':>9} {'all loaded':>11}  lazy modules loaded")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            samples = cold_start(n, runs, tmp)
+            p50 = {k: percentile([s[k] for s in samples], 50) for k in samples[0] if k != "lazy"}
+            card_p95 = percentile([s["card_ms"] for s in samples], 95)
+            lazy = sorted({m for s in samples for m in s["lazy"]}) or ["none"]
+            print(f"{n:>10} {p50['flet_ms']:>12.0f} {p50['import_ms']:>16.1f} {p50['paint_ms']:>12.0f} "
+                  f"{p50['card_ms']:>11.0f} {card_p95:>9.0f} {p50['loaded_ms']:>11.0f}  {', '.join(lazy)}")
+
+
+BASELINE_PATH = os.path.join(HERE, "bench_baseline.json")
+KEYSTROKES = ["ultra", "boost shoe", "bag"]
+SUITE_WIDTHS = [1200, 1100, 700, 560, 1000, 480, 1300, 900]  # within and across breakpoints
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Probe:
+    """Times, allocations, controls created and payload for one hot path.
+
+    Every sample is timed untraced; allocations come from one extra run
+    under tracemalloc so tracing doesn't skew the latencies.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.results = {}
+
+    def run(self, name, actions):
+        samples = []
+        created = sent = 0
+        for action in actions:
+            before = {id(c) for c in iter_controls(self.page.controls)}
+            payload = self.page.payload_bytes
+            t0 = time.perf_counter()
+            action()
+            samples.append((time.perf_counter() - t0) * 1000)
+            created += sum(1 for c in iter_controls(self.page.controls) if id(c) not in before)
+            sent += self.page.payload_bytes - payload
+        tracemalloc.start()
+        actions[-1]()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.results[name] = {
+            "n": len(samples),
+            "p50_ms": percentile(samples, 50), "p95_ms": percentile(samples, 95),
+            "p99_ms": percentile(samples, 99), "max_ms": max(samples),
+            "alloc_peak_kb": peak / 1e3,
+            "created_per_op": created / len(samples),
+            "payload_per_op": sent / len(samples),
+            "controls": count_controls(self.page.controls),
+        }
+
+
+def suite_run(n, tmp):
+    path = os.path.join(tmp, f"catalog-{n}.json")
+    write_synthetic_file(path, count=n)
+
+    def load():
+        with open(path, "rb") as f:
+            return ema_john.ProductStore(ema_john.iter_products(f))
+
+    load_samples = []
+    for _ in range(1 if n >= 1_000_000 else 3):
+        t0 = time.perf_counter()
+        load()
+        load_samples.append((time.perf_counter() - t0) * 1000)
+    throttle_ms = ema_john.RESIZE_THROTTLE_MS
+    ema_john.RESIZE_THROTTLE_MS = 0  # main() builds its throttle: the resize probe times the handler itself
+    try:
+        with open(path, "rb") as f:
+            t0 = time.perf_counter()
+            page = start_app(ema_john.iter_products(f), width=1200)
+            startup_ms = (time.perf_counter() - t0) * 1000
+    finally:
+        ema_john.RESIZE_THROTTLE_MS = throttle_ms
+    results = {
+        "catalog load": {"n": len(load_samples), "p50_ms": percentile(load_samples, 50),
+                         "p95_ms": max(load_samples), "p99_ms": max(load_samples),
+                         "max_ms": max(load_samples)},
+        "startup (load + index + first render)": {"n": 1, "p50_ms": startup_ms, "p95_ms": startup_ms,
+                                                  "p99_ms": startup_ms, "max_ms": startup_ms,
+                                                  "controls": count_controls(page.controls)},
+    }
+    probe = Probe(page)
+    search = find_control(page.controls, lambda c: isinstance(c, ft.TextField))
+    sort = find_control(page.controls, lambda c: isinstance(c, ft.Dropdown))
+    lv = product_list(page)
+
+    def set_query(q):
+        def action():
+            search.value = q
+            search.on_change(None)
+        return action
+
+    def set_sort(option):
+        def action():
+            sort.value = option
+            sort.on_change(None)
+        return action
+
+    probe.run("render_products (sort change)",
+              [set_sort(o.key) for o in sort.options[1:] + sort.options[:1]] * 3)
+    probe.run("on_search_or_sort (per keystroke)",
+              [set_query(q[:i]) for q in KEYSTROKES for i in range(len(q) + 1)] * 2)
+    set_query("")()
+
+    def toggle(label):
+        def action():
+            box = find_control(page.controls, lambda c: isinstance(c, ft.Checkbox)
+                               and c.label.startswith(label))
+            box.value = not box.value
+            box.on_change(Click(box))
+        return action
+
+    probe.run("facet toggle (counts + render)",
+              [toggle(label) for label in ("Bag", "In stock", "€50–100", "In stock", "Bag", "€50–100")] * 2)
+    add = find_control(lv, lambda c: isinstance(c, ft.ElevatedButton))
+    add.on_click(Click(add))
+    cart_lv = find_control(page.controls, lambda c: isinstance(c, ft.ListView) and c.spacing == 6)
+    plus, minus = (find_control(cart_lv.controls[0], lambda c, icon=icon: isinstance(c, ft.IconButton)
+                                and c.icon == icon) for icon in (ft.Icons.ADD, ft.Icons.REMOVE))
+    probe.run("refresh_cart_ui (per change_qty)",
+              [lambda b=b: b.on_click(Click(b)) for b in (plus, minus) * 25])
+
+    def resize(w):
+        def action():
+            page.width = w
+            page.on_resized(types.SimpleNamespace(width=w, height=page.height))
+        return action
+
+    probe.run("resize", [resize(w) for w in SUITE_WIDTHS * 4])
+    results.update(probe.results)
+    cards = [s["card_ms"] for s in cold_start(n, 1 if n >= 1_000_000 else 5, tmp)]
+    results["cold start (launch to first card)"] = {
+        "n": len(cards), "p50_ms": percentile(cards, 50), "p95_ms": percentile(cards, 95),
+        "p99_ms": percentile(cards, 99), "max_ms": max(cards)}
+    return results
+
+
+def check_fallback_catalog():
+    """The app has to start (and search) on FALLBACK_PRODUCTS, which lack category and seller."""
+    page = start_app([dict(p) for p in ema_john.FALLBACK_PRODUCTS])
+    assert has_card(page), "no product card on the fallback catalog"
+    search = find_control(page.controls, lambda c: isinstance(c, ft.TextField))
+    search.value = "mug"
+    search.on_change(None)
+    assert has_card(page), "search failed on the fallback catalog"
+
+
+def check_json_stream():
+    """iter_json_array decodes across any read size and fails fast on bad input.
+
+    A truncated array raises, wherever it is cut; a malformed item raises
+    after reading about one buffer, not the whole rest of the stream.
+    """
+    items = [{"id": f"p{i}", "name": "Café \u00e9 \"quoted\" ✓", "price": -12.5e3 + i,
+              "ok": True, "tags": [None, False, [1, 2.0]]} for i in range(50)]
+    body = json.dumps(items, ensure_ascii=False).encode()
+    for read_size in (1, 7, 64, 1 << 16):
+        assert list(ema_john.iter_json_array(io.BytesIO(body), read_size)) == items, read_size
+    for cut in range(len(body)):
+        try:
+            decoded = list(ema_john.iter_json_array(io.BytesIO(body[:cut]), 64))
+        except ValueError:
+            continue
+        raise AssertionError(f"array cut at byte {cut} decoded as {len(decoded)} items")
+    tail = json.dumps([{"id": i, "name": "x" * 100} for i in range(20000)])[1:].encode()
+    read_size = 1 << 12
+    for bad in (b'[{"id": 1}, {"id": tru}, ', b'[{"id": 1}, {"id" 2}, ', b'[{"id": 1}, {"id": 1x}, '):
+        stream = io.BytesIO(bad + tail)
+        try:
+            list(ema_john.iter_json_array(stream, read_size))
+        except ValueError:
+            assert stream.tell() <= 2 * read_size, (bad, stream.tell())
+        else:
+            raise AssertionError(f"malformed input decoded: {bad!r}")
+
+
+def bench_suite(sizes, save=None, baseline=None, tolerance=1.25, profile=False):
+    import platform
+
+    check_fallback_catalog()
+    check_json_stream()
+    report = {"python": platform.python_version(), "flet": ft.version.version,
+              "sizes": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            if profile:
+                import cProfile
+                import pstats
+
+                prof = cProfile.Profile()
+                report["sizes"][str(n)] = prof.runcall(suite_run, n, tmp)
+                print(f"\n{int(n):,} products: top functions by cumulative time")
+                pstats.Stats(prof).sort_stats("cumulative").print_stats(r"ema_john\.py", 25)
+            else:
+                report["sizes"][str(n)] = suite_run(n, tmp)
+    previous = None
+    if baseline and os.path.exists(baseline):
+        with open(baseline, encoding="utf-8") as f:
+            previous = json.load(f)["sizes"]
+    regressions = 0
+    for n, results in report["sizes"].items():
+        print(f"\n{int(n):,} products")
+        print(f"{'':>40} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'alloc KB':>9} "
+              f"{'created':>8} {'payload':>8} {'controls':>8}  vs baseline p95")
+        for name, r in results.items():
+            line = (f"{name:>40} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                    f"{r.get('alloc_peak_kb', 0):>9.0f} {r.get('created_per_op', 0):>8.1f} "
+                    f"{r.get('payload_per_op', 0):>8.0f} {r.get('controls', 0):>8}")
+            old = (previous or {}).get(n, {}).get(name)
+            if old:
+                # below a millisecond it's timer noise, not a regression
+                ratio = max(r["p95_ms"], 1.0) / max(old["p95_ms"], 1.0)
+                flag = "  REGRESSION" if ratio > tolerance else ""
+                regressions += bool(flag)
+                line += f"  {ratio:>5.2f}x{flag}"
+            print(line)
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        print(f"\nsaved {save}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("render", help="time per product render and peak control count")
+    r.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    r.add_argument("--repeat", type=int, default=3)
+    s = sub.add_parser("search", help="search index vs. linear scan")
+    s.add_argument("--size", type=int, default=100000)
+    o = sub.add_parser("sort", help="precomputed sort orders vs. re-sorting")
+    o.add_argument("--size", type=int, default=100000)
+    m = sub.add_parser("store", help="columnar ProductStore vs. list of dicts")
+    m.add_argument("--size", type=int, default=100000)
+    c = sub.add_parser("cache", help="cold vs. warm start with the catalog cache")
+    c.add_argument("--size", type=int, default=100000)
+    c.add_argument("--latency-ms", type=int, default=200)
+    f = sub.add_parser("firstpaint", help="time to first paint / first card, sync vs. async loading")
+    f.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    f.add_argument("--latency-ms", type=int, default=200)
+    g = sub.add_parser("ingest", help="peak RSS: whole-body json.loads vs. streaming parse")
+    g.add_argument("--mb", type=int, default=500)
+    w = sub.add_parser("_ingest")  # worker for `ingest`, one mode per process
+    w.add_argument("mode")
+    w.add_argument("path")
+    d = sub.add_parser("diff", help="controls created / update payload per cart click, keyed vs. rebuild")
+    d.add_argument("--cart", type=int, default=50)
+    z = sub.add_parser("resize", help="updates / controls created while dragging the window, throttled vs. not")
+    z.add_argument("--events", type=int, default=200)
+    i = sub.add_parser("images", help="image cache: downloads, thumbnail sizes, prefetch hits, eviction")
+    i.add_argument("--count", type=int, default=200)
+    v = sub.add_parser("sessions", help="memory and startup per session, shared catalog vs. one per session")
+    v.add_argument("--sessions", type=int, default=300)
+    v.add_argument("--size", type=int, default=10000)
+    x = sub.add_parser("refresh", help="background refresh: delta applied in place vs. full rebuild, cart clamping")
+    x.add_argument("--size", type=int, default=100000)
+    x.add_argument("--changes", type=int, default=500)
+    q = sub.add_parser("orders", help="order history: batched writes, page load at page 1 / middle / last vs. everything")
+    q.add_argument("--orders", type=int, default=20000)
+    t = sub.add_parser("startup", help="cold start in fresh processes: import time, time to first card")
+    t.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    t.add_argument("--runs", type=int, default=5)
+    u = sub.add_parser("suite", help="percentiles / allocations / controls per hot path, vs. a baseline")
+    u.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    u.add_argument("--save", nargs="?", const=BASELINE_PATH, help="write results as the new baseline")
+    u.add_argument("--baseline", default=BASELINE_PATH, help="compare against this file if it exists")
+    u.add_argument("--tolerance", type=float, default=1.25, help="p95 ratio that counts as a regression")
+    u.add_argument("--profile", action="store_true", help="also print a cProfile of ema_john's functions")
+    args = ap.parse_args()
+    if args.cmd == "render":
+        bench_render(args.sizes, args.repeat)
+    elif args.cmd == "search":
+        bench_search(args.size)
+    elif args.cmd == "sort":
+        bench_sort(args.size)
+    elif args.cmd == "store":
+        bench_store(args.size)
+    elif args.cmd == "cache":
+        bench_cache(args.size, args.latency_ms)
+    elif args.cmd == "firstpaint":
+        bench_firstpaint(args.sizes, args.latency_ms)
+    elif args.cmd == "ingest":
+        bench_ingest(args.mb)
+    elif args.cmd == "diff":
+        bench_diff(args.cart)
+    elif args.cmd == "resize":
+        bench_resize(args.events)
+    elif args.cmd == "images":
+        bench_images(args.count)
+    elif args.cmd == "sessions":
+        bench_sessions(args.sessions, args.size)
+    elif args.cmd == "refresh":
+        bench_refresh(args.size, args.changes)
+    elif args.cmd == "orders":
+        bench_orders(args.orders)
+    elif args.cmd == "startup":
+        bench_startup(args.sizes, args.runs)
+    elif args.cmd == "suite":
+        sys.exit(1 if bench_suite(args.sizes, args.save, args.baseline,
+                                     args.tolerance, args.profile) else 0)
+    elif args.cmd == "_ingest":
+        ingest_worker(args.mode, args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,2598 @@
 # ema_john_responsive_row_images_responsive.py
+import asyncio
+import bisect
+import codecs
+import copy
+import functools
+import hashlib
+import heapq
+import importlib.util
+import io
+import itertools
 import json
+import os
+import pickle
+import re
+import threading
+import time
+import urllib.error
 import urllib.request
 import math
+import operator
+import sys
+from array import array
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import ROUND_HALF_UP, Decimal
 import flet as ft
 
+try:
+    from flet.core.protocol import CommandEncoder
+except ImportError:  # other Flet layouts: payload sizes are then approximate
+    CommandEncoder = None
+
+# Pillow is imported by the first thumbnail, not at startup; without it images
+# are still cached, just not resized
+HAVE_PIL = importlib.util.find_spec("PIL") is not None
+
 PRODUCTS_JSON_URL = "https://raw.githubusercontent.com/MDAnwarHossen/ema-john/refs/heads/main/products.json"
 COLORS = getattr(ft, "colors", getattr(ft, "Colors", None))
 
-# ImageFit compatibility
-try:
-    from flet import ImageFit  # type: ignore
-    FIT_CONTAIN = ImageFit.CONTAIN
-except Exception:
+# ImageFit compatibility (a plain string where Flet has no ImageFit enum)
+FIT_CONTAIN = getattr(getattr(ft, "ImageFit", None), "CONTAIN", "contain")
+
+
+# Catalog source: the URL above, or a path / file:// URL to a products.json
+CATALOG_SOURCE = os.environ.get("EMA_JOHN_PRODUCTS", PRODUCTS_JSON_URL)
+BUNDLED_PRODUCTS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "products.json")
+
+# On-disk copy of the last fetched catalog, so startup never waits on the network
+CATALOG_CACHE = True
+CATALOG_CACHE_DIR = os.environ.get(
+    "EMA_JOHN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ema_john"))
+# Products parsed (and handed to the UI / cache) per step while the catalog streams in
+CATALOG_CHUNK_SIZE = 500
+
+FALLBACK_PRODUCTS = [
+    {"id": "f1", "name": "Headphones", "price": 19.99,
+     "img": "https://via.placeholder.com/220x160?text=Headphones", "stock": 10, "ratings": 4.2, "ratingsCount": 34, "shipping": 2.5},
+    {"id": "f2", "name": "Mug", "price": 7.5,
+     "img": "https://via.placeholder.com/220x160?text=Mug", "stock": 15, "ratings": 4.6, "ratingsCount": 80, "shipping": 1.5},
+]
+
+
+# ---------- Instrumentation ----------
+# Off unless EMA_JOHN_METRICS=1: timed functions are then returned undecorated.
+METRICS_ENABLED = os.environ.get("EMA_JOHN_METRICS", "") not in ("", "0")
+# Port for the JSON dump (GET /metrics.json); unset means no endpoint
+METRICS_PORT = int(os.environ.get("EMA_JOHN_METRICS_PORT") or 0)
+TIME_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SIZE_BUCKETS = (256, 1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20)
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are bucket upper bounds (capped at the max seen)."""
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        rank = pct / 100 * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def to_dict(self):
+        labels = [f"<={b:g}" for b in self.bounds] + [f">{self.bounds[-1]:g}"]
+        return {
+            "count": self.count, "sum": round(self.total, 3), "max": round(self.max, 3),
+            "mean": round(self.total / self.count, 3) if self.count else 0,
+            "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99),
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+
+class Metrics:
+    """Process-wide timing / size histograms and gauges.
+
+    Whether to record is decided when a function is decorated (or a page
+    instrumented), so a disabled registry costs nothing on the hot path.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self.timings = {}
+        self.sizes = {}
+        self.gauges = {}
+        self.probes = {}   # name -> fn, evaluated when a snapshot is taken
+        self._lock = threading.Lock()
+
+    def _histogram(self, table, name, bounds):
+        hist = table.get(name)
+        if hist is None:
+            with self._lock:
+                hist = table.setdefault(name, Histogram(bounds))
+        return hist
+
+    def timed(self, name):
+        """Decorator recording each call's wall time (ms) under `name`."""
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+            hist = self._histogram(self.timings, name, TIME_BUCKETS_MS)
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def timed_async(*args, **kwargs):
+                    t0 = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        hist.add((time.perf_counter() - t0) * 1000)
+                return timed_async
+
+            @functools.wraps(fn)
+            def timed_call(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    hist.add((time.perf_counter() - t0) * 1000)
+            return timed_call
+        return decorate
+
+    def observe(self, name, value):
+        if self.enabled:
+            self._histogram(self.sizes, name, SIZE_BUCKETS).add(value)
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def instrument_page(self, page):
+        """Time every page.update() and record the size of what it sends."""
+        if not self.enabled:
+            return
+        page.update = self.timed("page.update")(page.update)
+        conn = getattr(page, "_Page__conn", None)
+        if conn is None or not hasattr(conn, "send_commands"):
+            return
+        send = conn.send_commands
+
+        def send_commands(session_id, commands):
+            self.observe("update.payload_bytes",
+                         len(json.dumps(commands, cls=CommandEncoder, default=str)))
+            self.observe("update.commands", len(commands))
+            return send(session_id, commands)
+        conn.send_commands = send_commands
+
+    def snapshot(self):
+        gauges = dict(self.gauges)
+        for name, probe in list(self.probes.items()):
+            try:
+                gauges[name] = probe()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {
+            "enabled": self.enabled,
+            "uptime_s": round(time.time() - self.started, 1),
+            "timings_ms": {k: h.to_dict() for k, h in sorted(self.timings.items())},
+            "sizes": {k: h.to_dict() for k, h in sorted(self.sizes.items())},
+            "gauges": gauges,
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent)
+
+
+METRICS = Metrics(METRICS_ENABLED)
+
+
+def count_controls(controls):
+    stack = list(controls)
+    n = 0
+    while stack:
+        c = stack.pop()
+        n += 1
+        stack.extend(c._get_children())
+    return n
+
+
+# pages of the sessions still open; main() adds its page and on_close takes it out again
+OPEN_PAGES = set()
+
+
+def page_controls():
+    """The controls.page probe: control counts over every open session's page."""
+    counts = [count_controls(page.controls) for page in list(OPEN_PAGES)]
+    return {"sessions": len(counts), "total": sum(counts), "max": max(counts, default=0)}
+
+
+METRICS.probes["controls.page"] = page_controls
+
+
+def serve_metrics(port, metrics=METRICS, host="127.0.0.1"):
+    """Serve metrics.to_json() at http://host:port/metrics.json from a daemon thread."""
+    import http.server  # operators only: not part of a normal startup
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics.json"):
+                self.send_error(404)
+                return
+            body = metrics.to_json().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    return httpd
+
+
+def normalize_product(p, i):
+    return {
+        "id": str(p.get("id", i)),
+        "name": p.get("name", "Unnamed product"),
+        "price": float(p.get("price", 0)),
+        "img": p.get("img", "") or p.get("image", ""),
+        "category": p.get("category", ""),
+        "seller": p.get("seller", ""),
+        "stock": int(p.get("stock", p.get("quantity", 10) or 0)),
+        "ratings": float(p.get("ratings", p.get("rating", 0)) or 0),
+        "ratingsCount": int(p.get("ratingsCount", p.get("ratingCount", 0) or 0)),
+        "shipping": float(p.get("shipping", 0) or 0),
+    }
+
+
+def local_source_path(source):
+    """Filesystem path for a local catalog source, or None for a remote URL."""
+    if source.startswith("file://"):
+        return urllib.request.url2pathname(source[len("file://"):])
+    if "://" not in source:
+        return source
+    return None
+
+
+class CatalogCache:
+    """Last fetched catalog, normalized and pickled, plus its HTTP validators.
+
+    The data file is a sequence of pickled chunks, so it can be written
+    while the catalog streams in and read back without a second copy.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or CATALOG_CACHE_DIR
+        self.data_path = os.path.join(self.directory, "catalog.pickle")
+        self.meta_path = os.path.join(self.directory, "catalog.meta.json")
+
+    def meta(self):
+        # validators are only worth sending when the data they describe is still there
+        try:
+            if not os.path.exists(self.data_path):
+                return {}
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def iter_chunks(self):
+        with open(self.data_path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def load(self):
+        try:
+            products = []
+            for chunk in self.iter_chunks():
+                products.extend(chunk)
+            return products
+        except Exception:
+            return None
+
+    def store(self, products, **meta):
+        for _ in self.tee(products, meta):
+            pass
+
+    def tee(self, products, meta, chunk_size=None):
+        """Yield `products` while writing them through to the cache.
+
+        The cache is only replaced once the iterable is exhausted; an
+        abandoned or failed stream leaves the previous copy in place.
+        """
+        chunk_size = chunk_size or CATALOG_CHUNK_SIZE
+        tmp = self.data_path + ".tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            f = open(tmp, "wb")
+        except OSError as e:
+            print("Warning: failed to write catalog cache:", e)
+            yield from products
+            return
+        chunk = []
+        try:
+            with f:
+                for p in products:
+                    chunk.append(p)
+                    yield p
+                    if len(chunk) >= chunk_size:
+                        pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                        chunk = []
+                if chunk:
+                    pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        # write-then-rename so a crash never leaves a half-written cache behind
+        try:
+            os.replace(tmp, self.data_path)
+            with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+        except OSError as e:
+            print("Warning: failed to write catalog cache:", e)
+
+
+def iter_json_array(stream, read_size=1 << 16):
+    """Yield the items of a top-level JSON array one at a time.
+
+    `stream` is a binary file-like object (a file or an HTTP response);
+    only one read buffer and the item being decoded are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        data = stream.read(read_size)
+        if not data:
+            eof = True
+            buf = buf[pos:] + utf8.decode(b"", final=True)
+        else:
+            buf = buf[pos:] + utf8.decode(data)
+        pos = 0
+
+    while True:
+        # skip whitespace and separators up to the next value
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            fill()
+        if pos >= len(buf):
+            raise ValueError("unexpected end of JSON array")
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            # only an item cut off by the buffer end can decode after a refill: a cut literal
+            # or \uXXXX escape fails a few characters before the end, a cut string at its
+            # opening quote. Anything else is malformed, so don't read on to the end first.
+            cut = len(buf) - e.pos <= 5 or e.msg.startswith("Unterminated string")
+            if eof or not cut:
+                raise
+            fill()  # item straddles the buffer end
+            continue
+        if end == len(buf) and not eof:
+            fill()  # a number at the buffer end may continue in the next read
+            continue
+        pos = end
+        yield item
+
+
+def iter_products(stream):
+    for i, p in enumerate(iter_json_array(stream)):
+        yield normalize_product(p, i)
+
+
+def _open_source(source, meta, timeout):
+    """(binary stream, validators) for `source`, or None if `meta` is still current."""
+    path = local_source_path(source)
+    if path is not None:
+        st = os.stat(path)
+        validators = {"etag": f"{st.st_mtime_ns}-{st.st_size}", "last_modified": None}
+        if meta and meta.get("etag") == validators["etag"]:
+            return None
+        return open(path, "rb"), validators
+    req = urllib.request.Request(source)
+    if meta.get("etag"):
+        req.add_header("If-None-Match", meta["etag"])
+    if meta.get("last_modified"):
+        req.add_header("If-Modified-Since", meta["last_modified"])
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+    return resp, {"etag": resp.headers.get("ETag"),
+                  "last_modified": resp.headers.get("Last-Modified")}
+
+
+def open_catalog(source=CATALOG_SOURCE, cache=None, timeout=8, conditional=True):
+    """Normalized products from `source` as a generator, parsed item by item.
+
+    Returns None when `conditional` and the cached copy is still current
+    (ETag/Last-Modified, or mtime+size for local files). Products are
+    written through to `cache` as they stream past, so peak memory is one
+    read buffer and one item however large the catalog is.
+    """
+    meta = cache.meta() if cache and conditional else {}
+    if meta.get("source") != source:
+        meta = {}
+    opened = _open_source(source, meta, timeout)
+    if opened is None:
+        return None
+    stream, validators = opened
+
+    def items():
+        with stream:
+            yield from iter_products(stream)
+
+    if cache:
+        return cache.tee(items(), dict(source=source, **validators))
+    return items()
+
+
+def fetch_catalog(source=CATALOG_SOURCE, cache=None, timeout=8):
+    """The whole normalized catalog as a list, or None if the cached copy is current."""
+    items = open_catalog(source, cache, timeout)
+    return None if items is None else list(items)
+
+
+def load_offline_products(cache=None):
+    # offline: last cached catalog, then the products.json shipped with the app
+    cached = cache.load() if cache else None
+    if cached:
+        return cached
+    try:
+        with open(BUNDLED_PRODUCTS_PATH, "rb") as f:
+            return list(iter_products(f))
+    except Exception as e:
+        print("Warning: failed to load bundled products:", e)
+    return [dict(p) for p in FALLBACK_PRODUCTS]
+
+
+@METRICS.timed("safe_load_products")
+def safe_load_products(url=CATALOG_SOURCE, timeout=8, cache=None):
+    try:
+        cleaned = fetch_catalog(url, cache, timeout)
+        if cleaned is None:  # not modified: the cached copy is current
+            cleaned = cache.load()
+        if cleaned is not None:
+            return cleaned
+    except Exception as e:
+        print("Warning: failed to load remote products:", e)
+    return load_offline_products(cache)
+
+
+# Render the page shell first and stream the catalog in afterwards (needs page.run_task)
+ASYNC_CATALOG_LOAD = True
+
+
+async def stream_catalog(source=CATALOG_SOURCE, cache=None, timeout=8, chunk_size=None):
+    """Async generator of normalized product chunks, parsed off the event loop.
+
+    Each chunk is read, parsed and normalized on a worker thread as the
+    bytes arrive, so the first cards render before the download finishes.
+    If the source fails before any product arrived, the chunks come from
+    load_offline_products instead.
+    """
+    chunk_size = chunk_size or CATALOG_CHUNK_SIZE
+    delivered = False
+    try:
+        items = await asyncio.to_thread(open_catalog, source, cache, timeout, False)
+        while True:
+            chunk = await asyncio.to_thread(
+                lambda: list(itertools.islice(items, chunk_size)))
+            if not chunk:
+                return
+            delivered = True
+            yield chunk
+    except Exception as e:
+        print("Warning: failed to load remote products:", e)
+        if delivered:
+            return  # keep what already arrived
+    data = await asyncio.to_thread(load_offline_products, cache)
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+        await asyncio.sleep(0)
+
+
+def refresh_catalog_in_background(on_update, source=CATALOG_SOURCE, cache=None, timeout=8):
+    """Revalidate the catalog on a daemon thread; on_update(products) runs only if it changed."""
+    def run():
+        try:
+            cleaned = fetch_catalog(source, cache, timeout)
+        except Exception as e:
+            print("Warning: background catalog refresh failed:", e)
+            return
+        if cleaned is not None:
+            on_update(cleaned)
+
+    t = threading.Thread(target=run, name="catalog-refresh", daemon=True)
+    t.start()
+    return t
+
+
+# Seconds between background catalog refreshes (0: only the one after a cached start)
+CATALOG_REFRESH_S = float(os.environ.get("EMA_JOHN_REFRESH_S") or 300)
+# A refresh touching more than this share of the catalog rebuilds it instead of patching
+DELTA_REBUILD_FRACTION = 0.25
+
+# added: new products; removed: product ids; changed: (new product, names of fields that differ)
+CatalogDelta = namedtuple("CatalogDelta", "added removed changed")
+
+
+def diff_catalog(old, new):
+    """What turns the ProductStore `old` into the product list `new`, matched by id."""
+    old_by_id = old.records()
+    fields = ProductStore.FIELDS
+    added, changed = [], []
+    seen = set()
+    for p in new:
+        pid = p["id"]
+        if pid in seen:
+            continue
+        seen.add(pid)
+        current = old_by_id.get(pid)
+        if current is None:
+            added.append(p)
+            continue
+        values = tuple(map(p.get, fields))
+        if values != current:
+            changed.append((p, tuple(f for f, a, b in zip(fields, current, values) if a != b)))
+    removed = [pid for pid in old_by_id if pid not in seen]
+    return CatalogDelta(added, removed, changed)
+
+
+class CatalogRefresher:
+    """Re-fetches the catalog every `interval` seconds on a daemon thread.
+
+    on_update(products) only runs when the source reports a change
+    (conditional GET, or a newer local file); stop() ends the loop.
+    """
+
+    def __init__(self, on_update, interval=None, source=CATALOG_SOURCE, cache=None, timeout=8):
+        self.on_update = on_update
+        self.interval = CATALOG_REFRESH_S if interval is None else interval
+        self.source = source
+        self.cache = cache
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self.checks = 0
+        self.updates = 0
+
+    def run_once(self):
+        self.checks += 1
+        try:
+            products = fetch_catalog(self.source, self.cache, self.timeout)
+        except Exception as e:
+            print("Warning: catalog refresh failed:", e)
+            return False
+        if products is None:
+            return False
+        self.updates += 1
+        self.on_update(products)
+        return True
+
+    def start(self, immediately=False):
+        if self.interval <= 0 and not immediately:
+            return self
+
+        def run():
+            if immediately:
+                self.run_once()
+            while self.interval > 0 and not self._stop.wait(self.interval):
+                self.run_once()
+
+        threading.Thread(target=run, name="catalog-refresh", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def star_str(rating):
+    full = "★" * int(math.floor(rating))
+    empty = "☆" * max(0, 5 - int(math.floor(rating)))
+    return full + empty
+
+
+# ---------- Columnar product store ----------
+class ProductStore:
+    """Catalog kept column-wise instead of as one dict per product.
+
+    Numbers live in typed arrays and category/seller are stored as small
+    integer codes into a table of interned strings. Indexing or iterating
+    hands out ProductRow views that answer the same p["price"] /
+    p.get("seller", "-") lookups as the dicts safe_load_products builds;
+    there is one view per row, so every index over the store shares them.
+    Code that scans a whole field should read column() instead, which
+    skips the per-row lookups.
+    """
+
+    FIELDS = ("id", "name", "price", "img", "category", "seller",
+              "stock", "ratings", "ratingsCount", "shipping")
+    NUMERIC = {"price": "d", "shipping": "d", "ratings": "d",
+               "ratingsCount": "q", "stock": "q"}
+    INTERNED = ("category", "seller")
+
+    def __init__(self, products=()):
+        self._columns = {}
+        for field in self.FIELDS:
+            if field in self.NUMERIC:
+                self._columns[field] = array(self.NUMERIC[field])
+            elif field in self.INTERNED:
+                self._columns[field] = array("I")
+            else:
+                self._columns[field] = []
+        self._tables = {field: [None] for field in self.INTERNED}  # code -> string (0 = missing)
+        self._codes = {field: {None: 0} for field in self.INTERNED}
+        self._pos = {}  # product id -> row number
+        self._rows = []  # row number -> its ProductRow
+        # field -> reader(i); plain columns read straight through, interned ones via their table
+        self._readers = {}
+        for field, col in self._columns.items():
+            if field in self._tables:
+                self._readers[field] = (
+                    lambda i, col=col, table=self._tables[field]: table[col[i]])
+            else:
+                self._readers[field] = col.__getitem__
+        for p in products:
+            self.append(p)
+
+    def _encode(self, field, value):
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self._tables[field])
+            self._tables[field].append(sys.intern(value))
+        return code
+
+    def append(self, p):
+        cols = self._columns
+        self._pos[p["id"]] = len(cols["id"])
+        self._rows.append(ProductRow(self, len(cols["id"])))
+        for field in self.FIELDS:
+            value = p.get(field)
+            if field in self.NUMERIC:
+                cols[field].append(value or 0)
+            elif field in self.INTERNED:
+                cols[field].append(self._encode(field, value))
+            else:
+                cols[field].append(value)
+
+    def value(self, i, field):
+        return self._readers[field](i)
+
+    def set(self, i, field, value):
+        if field in self.INTERNED:
+            value = self._encode(field, value)
+        self._columns[field][i] = value
+
+    def index_of(self, pid):
+        return self._pos.get(pid)
+
+    def column(self, field, rows=None):
+        """Values of `field` for the row numbers `rows` (every row by default), in that order."""
+        col = self._columns[field]
+        if rows is not None:
+            col = map(col.__getitem__, rows)
+        if field in self._tables:
+            col = map(self._tables[field].__getitem__, col)
+        return list(col)
+
+    def rows_of(self, products):
+        """Row numbers of the sequence `products`, or None unless every one is a row of this store."""
+        try:
+            if not set(map(operator.attrgetter("_store"), products)) <= {self}:
+                return None
+            return list(map(operator.attrgetter("_i"), products))
+        except AttributeError:
+            return None
+
+    def rows_at(self, rows):
+        return list(map(self._rows.__getitem__, rows))
+
+    def discard(self, pid):
+        # the row stays (positions never move under live ProductRows) but is no longer found by id
+        self._pos.pop(pid, None)
+
+    def records(self):
+        """product id -> tuple of FIELDS values, for every product not discarded."""
+        columns = []
+        for field in self.FIELDS:
+            col = self._columns[field]
+            if field in self._tables:
+                col = map(self._tables[field].__getitem__, col)
+            columns.append(col)
+        rows = list(zip(*columns))
+        return {pid: rows[i] for pid, i in self._pos.items()}
+
+    def __len__(self):
+        return len(self._columns["id"])
+
+    def __getitem__(self, i):
+        return self._rows[i]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def copy(self):
+        return list(self)
+
+
+class ProductRow(Mapping):
+    """Read-through view of one ProductStore row, usable like a product dict."""
+
+    __slots__ = ("_store", "_i")
+
+    def __init__(self, store, i):
+        self._store = store
+        self._i = i
+
+    def __getitem__(self, key):
+        v = self._store._readers[key](self._i)
+        if v is None:
+            raise KeyError(key)
+        return v
+
+    def get(self, key, default=None):
+        reader = self._store._readers.get(key)
+        if reader is None:
+            return default
+        v = reader(self._i)
+        return default if v is None else v
+
+    def __iter__(self):
+        store, i = self._store, self._i
+        return (f for f in store.FIELDS if store.value(i, f) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if isinstance(other, ProductRow):
+            return self._store is other._store and self._i == other._i
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self):
+        return hash((id(self._store), self._i))
+
+    def __repr__(self):
+        return f"ProductRow({dict(self)!r})"
+
+
+# ---------- Search index ----------
+# Fields searched from the search box, with the weight a match in each adds to the score
+SEARCH_FIELDS = (("name", 3), ("category", 2), ("seller", 1))
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text or "").casefold())
+
+
+class SearchIndex:
+    """Inverted token index over name, category and seller.
+
+    Every query token must match the start of some token in a product, so
+    "ultra sho" finds "ULTRABOOST 22 SHOES" but "boost" does not. Results
+    are ranked by field weight, exact matches beating prefix matches, with
+    catalog order breaking ties.
+
+    Products are numbered in the order they are added (like FacetIndex)
+    and a token's postings are one set of those positions per field
+    weight, so matching, intersecting and grouping by score are set
+    operations on small ints and catalog order is just int order.
+    """
+
+    def __init__(self, products=()):
+        self.ids = []         # position -> product id
+        self._pos = {}        # product id -> position
+        self._products = []   # position -> product (None once removed)
+        self._doc_tokens = []  # position -> {token: weight}
+        self._postings = {}   # token -> {weight: {position, ...}}
+        self._vocab = []      # sorted tokens, for prefix range lookups
+        self._new_tokens = []  # tokens not yet merged into _vocab
+        self.extend(products)
+
+    def __len__(self):
+        return len(self._pos)
+
+    def add(self, p):
+        self._add(p)
+        self._merge_vocab()
+
+    def extend(self, products):
+        # index a batch, then merge its new tokens into the vocabulary in one pass
+        for p in products:
+            self._add(p)
+        self._merge_vocab()
+
+    def _merge_vocab(self):
+        new = sorted({tok for tok in self._new_tokens if tok in self._postings})
+        self._new_tokens = []
+        if len(new) == 1:
+            bisect.insort(self._vocab, new[0])
+        elif new:
+            # timsort merges the two sorted runs in linear time
+            self._vocab.extend(new)
+            self._vocab.sort()
+
+    def _add(self, p, keep_position=False):
+        pid = p["id"]
+        if not keep_position:
+            self.remove(pid)  # re-adding a product moves it last, like a new one
+        i = self._pos.get(pid)
+        if i is None:
+            i = self._pos[pid] = len(self.ids)
+            self.ids.append(pid)
+            self._products.append(None)
+            self._doc_tokens.append({})
+        else:
+            self._unindex(i)
+        tokens = {}
+        for field, weight in SEARCH_FIELDS:
+            for tok in tokenize(p.get(field, "")):
+                if weight > tokens.get(tok, 0):
+                    tokens[tok] = weight
+        self._products[i] = p
+        self._doc_tokens[i] = tokens
+        for tok, weight in tokens.items():
+            posting = self._postings.get(tok)
+            if posting is None:
+                posting = self._postings[tok] = {}
+                self._new_tokens.append(tok)
+            positions = posting.get(weight)
+            if positions is None:
+                posting[weight] = {i}
+            else:
+                positions.add(i)
+
+    def _unindex(self, i):
+        for tok, weight in self._doc_tokens[i].items():
+            posting = self._postings[tok]
+            posting[weight].discard(i)
+            if not posting[weight]:
+                del posting[weight]
+            if not posting:
+                del self._postings[tok]
+                j = bisect.bisect_left(self._vocab, tok)
+                if j < len(self._vocab) and self._vocab[j] == tok:
+                    del self._vocab[j]
+        self._doc_tokens[i] = {}
+        self._products[i] = None
+
+    def remove(self, pid):
+        # the position is not reused: the product goes last if it is added again
+        i = self._pos.pop(pid, None)
+        if i is not None:
+            self._unindex(i)
+
+    def update(self, p):
+        # re-indexing a product keeps its position, and so its place in catalog order
+        self._add(p, keep_position=True)
+        self._merge_vocab()
+
+    def _prefix_range(self, qtok):
+        # every vocabulary token starting with qtok
+        vocab = self._vocab
+        lo = bisect.bisect_left(vocab, qtok)
+        return vocab[lo:bisect.bisect_left(vocab, qtok + "\U0010ffff", lo)]
+
+    def _cost(self, qtok, cap):
+        # postings in qtok's prefix range, counted up to cap
+        cost = 0
+        for tok in self._prefix_range(qtok):
+            cost += sum(map(len, self._postings[tok].values()))
+            if cost > cap:
+                break
+        return cost
+
+    def _match(self, qtok, within=None):
+        """{score: positions} for the products (in `within`, if given) with a token starting with qtok.
+
+        Each product is in the group of its best score only.
+        """
+        groups = {}
+        for tok in self._prefix_range(qtok):
+            bonus = 2 if tok == qtok else 1
+            for weight, positions in self._postings[tok].items():
+                groups.setdefault(weight * bonus, []).append(positions)
+        levels = {}
+        rest = within  # products not yet given a (higher) score; None: any product
+        seen = set()
+        for score in sorted(groups, reverse=True):
+            if rest is None:
+                positions = set().union(*groups[score]) - seen
+                seen |= positions
+            else:
+                positions = set().union(*(p & rest for p in groups[score]))
+                rest = rest - positions
+            if positions:
+                levels[score] = positions
+            if rest is not None and not rest:
+                break
+        return levels
+
+    def hits(self, query, within=None):
+        """{score: positions} for the products matching `query`, unranked.
+
+        The most selective query token is matched first and the others only
+        within its hits. `within` is an earlier hits() result for a broader
+        query; when it is small next to the postings its products are
+        rescored directly instead.
+        """
+        qtoks = list(dict.fromkeys(tokenize(query)))
+        if not qtoks:
+            return {}
+        if within is not None:
+            candidates = set().union(*within.values())
+            if self._narrowing_pays(qtoks, len(candidates)):
+                return self._score_within(qtoks, candidates)
+        cap = len(self.ids)
+        qtoks.sort(key=lambda qtok: self._cost(qtok, cap))
+        levels = self._match(qtoks[0])
+        for i, qtok in enumerate(qtoks[1:], 1):
+            if not levels:
+                break
+            candidates = set().union(*levels.values()) if len(levels) > 1 else next(iter(levels.values()))
+            if self._narrowing_pays(qtoks[i:], len(candidates)):
+                return self._combine(levels, self._score_within(qtoks[i:], candidates))
+            levels = self._combine(levels, self._match(qtok, candidates))
+        return levels
+
+    @staticmethod
+    def _combine(a, b):
+        # products in both, grouped by the sum of their scores
+        if len(b) == 1 and len(next(iter(b.values()))) == sum(map(len, a.values())):
+            # b is a's products (matched within them) all at one score: shift a's scores
+            (score_b, _), = b.items()
+            return {score_a + score_b: positions for score_a, positions in a.items()}
+        levels = {}
+        for score_a, positions_a in a.items():
+            for score_b, positions_b in b.items():
+                both = positions_a & positions_b
+                if both:
+                    score = score_a + score_b
+                    if score in levels:
+                        levels[score] |= both
+                    else:
+                        levels[score] = both
+        return levels
+
+    def _ranked(self, levels, limit=None):
+        # positions by score, then position (catalog order); only the first `limit` are sorted
+        ranked = []
+        for score in sorted(levels, reverse=True):
+            positions = levels[score]
+            if limit is not None and limit - len(ranked) < len(positions):
+                ranked += heapq.nsmallest(limit - len(ranked), positions)
+                break
+            ranked += sorted(positions)
+        return ranked
+
+    def rank(self, levels, limit=None):
+        """Product ids of a hits() result by score, catalog order breaking ties; the first `limit` only."""
+        return list(map(self.ids.__getitem__, self._ranked(levels, limit)))
+
+    def ids_of(self, levels):
+        """Product ids of a hits() result, unranked."""
+        return map(self.ids.__getitem__, itertools.chain.from_iterable(levels.values()))
+
+    def search_ids(self, query, within=None, limit=None):
+        """Ranked product ids matching `query` (see hits and rank)."""
+        return self.rank(self.hits(query, within), limit)
+
+    def _narrowing_pays(self, qtoks, n_within):
+        # rescoring costs ~ one pass over each candidate's tokens; matching costs a set
+        # intersection per posting group in every prefix range. Stop counting once it loses.
+        budget = n_within * 16
+        cost = 0
+        for qtok in qtoks:
+            for tok in self._prefix_range(qtok):
+                for positions in self._postings[tok].values():
+                    cost += min(len(positions), n_within) + 64
+                    if cost > budget:
+                        return True
+        return False
+
+    def _score_within(self, qtoks, within):
+        levels = {}
+        doc_tokens = self._doc_tokens
+        for i in within:
+            toks = doc_tokens[i]
+            score = 0
+            for qtok in qtoks:
+                best = 0
+                for tok, weight in toks.items():
+                    if tok.startswith(qtok):
+                        s = weight * 2 if tok == qtok else weight
+                        if s > best:
+                            best = s
+                if not best:
+                    break
+                score += best
+            else:
+                levels.setdefault(score, set()).add(i)
+        return levels
+
+    def search(self, query, limit=None):
+        return list(map(self._products.__getitem__, self._ranked(self.hits(query), limit)))
+
+
+# ---------- Facets ----------
+PRICE_RANGES = ((0, 25), (25, 50), (50, 100), (100, 250), (250, None))
+RATING_FLOORS = (4, 3, 2, 1)
+FACET_MAX_VALUES = 12  # longer facets show their most common values (plus any ticked ones)
+
+
+def price_range_label(price):
+    for lo, hi in PRICE_RANGES:
+        if hi is None or price < hi:
+            return f"€{lo}+" if hi is None else (f"Under €{hi}" if lo == 0 else f"€{lo}–{hi}")
+    return f"€{PRICE_RANGES[-1][0]}+"
+
+
+# facet -> (product field it reads, that field's value -> the facet value; None: not in any bucket)
+FACETS = {
+    "category": ("category", lambda v: v or "Other"),
+    "seller": ("seller", lambda v: v or "Unknown"),
+    "price": ("price", price_range_label),
+    "rating": ("ratings", lambda v: next((f"{f}★ & up" for f in RATING_FLOORS if v >= f), None)),
+    "stock": ("stock", lambda v: "In stock" if v > 0 else None),
+}
+FACET_TITLES = {"category": "Category", "seller": "Seller", "price": "Price",
+                "rating": "Rating", "stock": "Availability"}
+# display order for facets whose values have a natural order; the rest are alphabetical
+FACET_ORDERS = {
+    "price": [price_range_label(lo) for lo, _ in PRICE_RANGES],
+    "rating": [f"{f}★ & up" for f in RATING_FLOORS],
+}
+# facets whose buckets include every bucket before them ("3★ & up" covers "4★ & up" products)
+FACET_CUMULATIVE = ("rating",)
+
+
+class FacetIndex:
+    """One bitmap per facet value over product positions (bit i = i-th product added).
+
+    Each facet is kept as a column of small value codes; the bitmaps
+    (plain ints) are built from the columns on first use, one pass per
+    facet however many values it has, and then kept current: positions
+    added later are ORed in and a changed or removed product flips only
+    its own bits. Combining facets is then an & of ints and a facet count
+    is int.bit_count(), never a pass over the products themselves.
+    """
+
+    # product fields the facets are computed from
+    FIELDS = ("id", *dict.fromkeys(field for field, _ in FACETS.values()))
+
+    def __init__(self, products=(), columns=None):
+        self.ids = []    # position -> product id
+        self._pos = {}   # product id -> position
+        self._codes = {facet: {None: 0} for facet in FACETS}        # facet -> value -> code
+        self._values = {facet: [None] for facet in FACETS}          # facet -> code -> value
+        self._columns = {facet: array("I") for facet in FACETS}     # facet -> code per position
+        self._bitmaps = None
+        self._built = 0  # positions below this are in the bitmaps
+        self.extend(products, columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extend(self, products, columns=None):
+        """Index `products`; `columns` ({field: values in product order} for FIELDS) saves reading them per product."""
+        if columns is None:
+            products = list(products)
+            columns = {field: [p.get(field) for p in products] for field in self.FIELDS}
+        ids, pos, batch = self.ids, self._pos, columns["id"]
+        if pos.keys().isdisjoint(batch) and len(set(batch)) == len(batch):
+            new = None  # every product is new
+            pos.update(zip(batch, range(len(ids), len(ids) + len(batch))))
+            ids.extend(batch)
+        else:
+            new = []  # column offsets of the products not indexed yet
+            for k, pid in enumerate(batch):
+                if pid in pos:
+                    continue  # duplicate id: already indexed
+                pos[pid] = len(ids)
+                ids.append(pid)
+                new.append(k)
+        for facet, (field, value_of) in FACETS.items():
+            column = columns[field]
+            if new is not None:
+                column = list(map(column.__getitem__, new))
+            # one value_of call per distinct field value, not per product
+            value_of = {v: value_of(v) for v in set(column)}.__getitem__
+            values = list(map(value_of, column))
+            codes = self._codes[facet]
+            for value in set(values).difference(codes):
+                codes[value] = len(codes)
+                self._values[facet].append(value)
+            self._columns[facet].extend(map(codes.__getitem__, values))
+        # the new positions are ORed into the bitmaps on next use, not per streamed batch
+
+    def update(self, products):
+        """Re-read the facet values of products already indexed (in place); index the rest."""
+        new = []
+        for p in products:
+            i = self._pos.get(p["id"])
+            if i is None:
+                new.append(p)
+                continue
+            for facet, (field, value_of) in FACETS.items():
+                codes = self._codes[facet]
+                value = value_of(p.get(field))
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                    self._values[facet].append(value)
+                self._recode(facet, i, code)
+        self.extend(new)
+
+    def remove(self, pids):
+        # a removed product keeps its position but drops out of every facet value
+        for pid in pids:
+            i = self._pos.get(pid)
+            if i is not None:
+                for facet in FACETS:
+                    self._recode(facet, i, 0)
+
+    def _recode(self, facet, i, code):
+        column = self._columns[facet]
+        old = column[i]
+        if old == code:
+            return
+        column[i] = code
+        if self._bitmaps is None or i >= self._built:
+            return
+        old, new = self._values[facet][old], self._values[facet][code]
+        table = self._bitmaps[facet]
+        bit = 1 << i
+        if facet in FACET_CUMULATIVE:
+            # bit i is set in its own bucket and every bucket after it: toggle the ones in between
+            order = FACET_ORDERS[facet]
+            lo, hi = sorted(len(order) if v is None else order.index(v) for v in (old, new))
+            for value in order[lo:hi]:
+                table[value] = table.get(value, 0) ^ bit
+            return
+        if old is not None:
+            table[old] &= ~bit
+        if new is not None:
+            table[new] = table.get(new, 0) | bit
+
+    def _bitmap_of(self, positions, start=0):
+        bits = bytearray((len(self.ids) - start + 7) // 8)
+        for i in positions:
+            i -= start
+            bits[i >> 3] |= 1 << (i & 7)
+        return int.from_bytes(bits, "little") << start
+
+    def bitmaps(self):
+        if self._bitmaps is None:
+            self._bitmaps = {facet: {} for facet in FACETS}
+            self._built = 0
+        start = self._built
+        if start < len(self.ids):
+            for facet, codes in self._codes.items():
+                # one pass groups the new positions by value code
+                groups = {}
+                for i, code in enumerate(self._columns[facet][start:], start):
+                    positions = groups.get(code)
+                    if positions is None:
+                        groups[code] = [i]
+                    else:
+                        positions.append(i)
+                added = {value: self._bitmap_of(groups[code], start)
+                         for value, code in codes.items() if value is not None and code in groups}
+                table = self._bitmaps[facet]
+                if facet in FACET_CUMULATIVE:
+                    running = 0
+                    for value in FACET_ORDERS[facet]:
+                        running |= added.get(value, 0)
+                        table[value] = table.get(value, 0) | running
+                    continue
+                for value, bitmap in added.items():
+                    table[value] = table.get(value, 0) | bitmap
+            self._built = len(self.ids)
+        return self._bitmaps
+
+    @property
+    def all(self):
+        return (1 << len(self.ids)) - 1
+
+    def values(self, facet):
+        present = self.bitmaps()[facet]
+        order = FACET_ORDERS.get(facet)
+        if order is None:
+            return sorted(present)
+        return [v for v in order if v in present]
+
+    def ids_bitmap(self, ids):
+        pos = self._pos
+        return self._bitmap_of(pos[pid] for pid in ids if pid in pos)
+
+    def select(self, selection, skip=None):
+        """Bitmap of products matching every facet in `selection` (any of its values), or None if none apply."""
+        bitmaps = self.bitmaps()
+        result = None
+        for facet, values in selection.items():
+            if facet == skip or not values:
+                continue
+            table = bitmaps[facet]
+            union = 0
+            for value in values:
+                union |= table.get(value, 0)
+            result = union if result is None else result & union
+        return result
+
+    def counts(self, base, selection):
+        """{facet: {value: count}} within `base`.
+
+        A facet's own selection is left out of its counts, so they show
+        what ticking one more of its values would add.
+        """
+        bitmaps = self.bitmaps()
+        counts = {}
+        for facet in FACETS:
+            scope = self.select(selection, skip=facet)
+            scope = base if scope is None else base & scope
+            table = bitmaps[facet]
+            counts[facet] = {value: (scope & table[value]).bit_count() for value in self.values(facet)}
+        return counts
+
+    def iter_ids(self, bitmap):
+        ids = self.ids
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        for byte_i, byte in enumerate(data):
+            while byte:
+                low = byte & -byte
+                yield ids[(byte_i << 3) + low.bit_length() - 1]
+                byte ^= low
+
+    def member(self, bitmap):
+        """Predicate: is product id in `bitmap`?"""
+        data = bitmap.to_bytes((len(self.ids) + 7) // 8, "little")
+        pos = self._pos
+        return lambda pid: (data[pos[pid] >> 3] >> (pos[pid] & 7)) & 1
+
+
+# ---------- Filter + sort engine ----------
+# Sort dropdown values and the key each orders the catalog by ("Relevance" keeps catalog/search order)
+SORT_KEYS = {
+    "Price: Low → High": lambda p: p["price"],
+    "Price: High → Low": lambda p: -p["price"],
+    "Top Rated": lambda p: (-p.get("ratings", 0), -p.get("ratingsCount", 0)),
+}
+# the same orders as (field, descending) columns, most significant first, for sorting a ProductStore
+SORT_COLUMNS = {
+    "Price: Low → High": (("price", False),),
+    "Price: High → Low": (("price", True),),
+    "Top Rated": (("ratings", True), ("ratingsCount", True)),
+}
+# fields each sort order depends on: a change to one moves the product in that order
+SORT_FIELDS = {name: {field for field, _ in columns} for name, columns in SORT_COLUMNS.items()}
+
+
+class FilterSortEngine:
+    """Search + sort over a catalog, with every sort order precomputed.
+
+    Each order in SORT_KEYS is computed once per catalog, so a sort change
+    is a walk of the precomputed order (or a sort of the hits by their
+    precomputed rank, whichever is smaller) instead of a fresh sort. A
+    query that extends the previous one is narrowed from its results.
+    """
+
+    def __init__(self, products, index=None):
+        self.index = index if index is not None else SearchIndex(products)
+        self.rebuild(products)
+
+    def rebuild(self, products):
+        self.products = products
+        if isinstance(products, ProductStore):
+            self._by_id = dict(zip(products.column("id"), products))
+        else:
+            self._by_id = {p["id"]: p for p in products}
+        # catalog position of each product: ties in a sort order stay in this order
+        self._seq = dict(zip(self._by_id, range(len(self._by_id))))
+        self._next_seq = len(self._seq)
+        live = self._by_id.values()
+        self.facets = FacetIndex(live, self._columns(live, FacetIndex.FIELDS))
+        self._build_orders()
+
+    def _columns(self, products, fields):
+        # {field: values} for products that are rows of a ProductStore catalog, read off its columns
+        store = self.products
+        rows = store.rows_of(products) if isinstance(store, ProductStore) else None
+        if rows is None:
+            return None
+        return {field: store.column(field, rows) for field in fields}
+
+    def _place(self, pid):
+        # an id already in the catalog keeps its position, as it does in _by_id
+        if pid not in self._seq:
+            self._seq[pid] = self._next_seq
+            self._next_seq += 1
+
+    def _build_orders(self):
+        self.orders = {}  # sort name -> products in that order
+        self.ranks = {}   # sort name -> {product id: position in order}
+        store = self.products
+        rows = store.rows_of(self._by_id.values()) if isinstance(store, ProductStore) else None
+        columns = {}
+        for name, key in SORT_KEYS.items():
+            if rows is None:
+                order = sorted(self._by_id.values(), key=key)
+                self.orders[name] = order
+                self.ranks[name] = {p["id"]: i for i, p in enumerate(order)}
+                continue
+            # sort row numbers by the typed columns, least significant first (each sort is
+            # stable, reverse=True included, so ties keep catalog order)
+            order = rows
+            for field, descending in reversed(SORT_COLUMNS[name]):
+                if field not in columns:
+                    columns[field] = store.column(field)
+                order = sorted(order, key=columns[field].__getitem__, reverse=descending)
+            self.orders[name] = store.rows_at(order)
+            self.ranks[name] = dict(zip(store.column("id", order), range(len(order))))
+        self._stale = False
+        self._last_q = None
+        self._last_ids = None
+        self._hits_bitmap = (None, None)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def get(self, pid):
+        return self._by_id.get(pid)
+
+    def apply_delta(self, added, removed, changed):
+        """Patch the catalog in place instead of rebuilding it.
+
+        `changed` is (product, fields) for products whose values already
+        changed. Only products that moved are taken out of a sort order and
+        bisected back in by (sort key, catalog position), so ties end up
+        where a rebuild would put them; its ranks are renumbered once (the
+        rank dict keeps the ids in sort order, so that is a C-level zip).
+        """
+        by_id, seq = self._by_id, self._seq
+        gone = set(removed)
+        for pid in removed:
+            by_id.pop(pid, None)
+            seq.pop(pid, None)
+        for p in added:
+            by_id[p["id"]] = p
+            self._place(p["id"])
+        self.facets.remove(removed)
+        self.facets.update([*added, *(p for p, _ in changed)])
+        self._last_q = self._last_ids = None
+        self._hits_bitmap = (None, None)
+        if self._stale:
+            return  # orders are rebuilt on the next sorted query anyway
+        for name, key in SORT_KEYS.items():
+            moved = [p for p, fields in changed if SORT_FIELDS[name].intersection(fields)]
+            moved += added
+            if not moved and not gone:
+                continue
+            rank = self.ranks[name]
+            keep = bytearray(b"\x01") * len(rank)
+            for pid in gone.union(p["id"] for p in moved):
+                if pid in rank:
+                    keep[rank[pid]] = 0
+            order = list(itertools.compress(self.orders[name], keep))
+            ids = list(itertools.compress(rank, keep))
+
+            def placed(p, key=key):
+                return key(p), seq[p["id"]]
+
+            for p in moved:
+                i = bisect.bisect_left(order, placed(p), key=placed)
+                order.insert(i, p)
+                ids.insert(i, p["id"])
+            self.orders[name] = order
+            self.ranks[name] = dict(zip(ids, range(len(ids))))
+
+    def fork(self):
+        """An engine over the same catalog and precomputed orders with its own query state.
+
+        The orders, ranks and facet bitmaps are shared and only read, so a
+        forked engine must not be extended.
+        """
+        clone = copy.copy(self)
+        clone._last_q = clone._last_ids = None
+        clone._hits_bitmap = (None, None)
+        return clone
+
+    def extend(self, new_products):
+        """Products appended to self.products while the catalog streams in.
+
+        Sort orders are rebuilt on the next sorted query rather than per batch.
+        """
+        for p in new_products:
+            self._by_id[p["id"]] = p
+            self._place(p["id"])
+        self.facets.extend(new_products, self._columns(new_products, FacetIndex.FIELDS))
+        self._stale = True
+        self._last_q = None
+        self._last_ids = None
+        self._hits_bitmap = (None, None)
+
+    def _hits(self, q):
+        # SearchIndex.hits() for q: unranked, since only Relevance needs the ranking
+        if q == self._last_q:
+            return self._last_ids
+        # token-prefix matching is monotonic: appending to a query can only shrink its results
+        if self._last_ids is not None and q.startswith(self._last_q):
+            hits = self.index.hits(q, within=self._last_ids)
+        else:
+            hits = self.index.hits(q)
+        self._last_q, self._last_ids = q, hits
+        return hits
+
+    def query(self, q, sort_val="Relevance", selection=None):
+        """Products matching `q` and every facet in `selection` ({facet: values}), sorted."""
+        q = q.strip().casefold()
+        if self._stale and sort_val in SORT_KEYS:
+            self._build_orders()
+        order = self.orders.get(sort_val)
+        allowed = self.facets.select(selection) if selection else None
+        if not q:
+            self._last_q = self._last_ids = None
+            if allowed is None:
+                return list(self._by_id.values() if order is None else order)
+            ids = list(self.facets.iter_ids(allowed))
+        else:
+            hits = self._hits(q)
+            ids = self.index.rank(hits) if order is None else self.index.ids_of(hits)
+            if allowed is not None:
+                keep = self.facets.member(allowed)
+                ids = [pid for pid in ids if keep(pid)]
+            elif order is not None:
+                ids = list(ids)
+        if order is None:
+            by_id = self._by_id
+            return [by_id[pid] for pid in ids]
+        if len(ids) * max(1, len(ids).bit_length()) < len(order):
+            # few hits: sort them by their precomputed rank (cheap int keys)
+            rank = self.ranks[sort_val]
+            return [order[i] for i in sorted(rank[pid] for pid in ids)]
+        # many hits: mark their ranks, then one O(n) pass over the precomputed order
+        rank = self.ranks[sort_val]
+        mask = bytearray(len(order))
+        for pid in ids:
+            mask[rank[pid]] = 1
+        return list(itertools.compress(order, mask))
+
+    def facet_counts(self, q, selection=None):
+        """Live counts per facet value for the products matching `q` (see FacetIndex.counts)."""
+        q = q.strip().casefold()
+        if not q:
+            base = self.facets.all
+        elif self._hits_bitmap[0] == q:
+            base = self._hits_bitmap[1]
+        else:
+            base = self.facets.ids_bitmap(self.index.ids_of(self._hits(q)))
+            self._hits_bitmap = (q, base)
+        return self.facets.counts(base, selection or {})
+
+
+# ---------- Search pipeline ----------
+# Keystrokes closer together than this are coalesced into one search
+SEARCH_DEBOUNCE_MS = 150
+
+
+class SearchPipeline:
+    """Debounced search: only the newest query's results get rendered.
+
+    `submit` restarts the debounce timer, so a burst of keystrokes runs one
+    search. A result computed for a query that has since been superseded
+    is dropped instead of rendered. With a debounce of 0 queries run
+    synchronously on the caller's thread.
+    """
+
+    # the per-pipeline counters summed over every session; a METRICS probe
+    totals = dict.fromkeys(("received", "coalesced", "dropped", "rendered"), 0)
+    _totals_lock = threading.Lock()
+
+    def __init__(self, compute, render, debounce_ms=None):
+        self._compute = compute
+        self._render = render
+        self.debounce_ms = SEARCH_DEBOUNCE_MS if debounce_ms is None else debounce_ms
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._timer = None
+        self._generation = 0
+        self.received = 0   # queries submitted
+        self.coalesced = 0  # superseded before their search ran
+        self.dropped = 0    # searched, but stale by the time results were ready
+        self.rendered = 0   # results that reached the product list
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        with SearchPipeline._totals_lock:
+            SearchPipeline.totals[name] += 1
+
+    def submit(self, *query, delay_ms=None):
+        delay = self.debounce_ms if delay_ms is None else delay_ms
+        with self._lock:
+            self._count("received")
+            self._generation += 1
+            gen = self._generation
+            if self._timer is not None:
+                self._timer.cancel()
+                self._count("coalesced")
+                self._timer = None
+            if delay > 0:
+                self._timer = threading.Timer(delay / 1000, self._run, (gen, query))
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self._run(gen, query)
+
+    def _run(self, gen, query):
+        with self._lock:
+            if gen != self._generation:
+                return  # already counted as coalesced
+            self._timer = None
+        result = self._compute(*query)
+        with self._render_lock:
+            if gen != self._generation:
+                self._count("dropped")
+                return
+            self._count("rendered")
+            self._render(result)
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+                self._count("coalesced")
+
+    def stats(self):
+        return {"received": self.received, "coalesced": self.coalesced,
+                "dropped": self.dropped, "rendered": self.rendered}
+
+    @classmethod
+    def total_stats(cls):
+        with cls._totals_lock:
+            return dict(cls.totals)
+
+
+METRICS.probes["search.pipeline"] = SearchPipeline.total_stats
+
+
+# ---------- Cart ----------
+def to_cents(amount):
+    # via str so 19.99 is 1999 cents, not 1998.9999...
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}€{cents // 100:,}.{cents % 100:02d}"
+
+
+class Cart:
+    """Cart lines with running totals kept in integer cents.
+
+    Lines are {"product", "qty"} dicts keyed by product id, as before.
+    Every change applies only that line's delta to the subtotal, shipping
+    and item count, so totals cost O(1) per change however large the cart.
+    Quantities are clamped to the product's stock. `take_touched` hands the
+    UI the ids of changed lines so it can patch just those rows.
+    """
+
+    def __init__(self):
+        self._lines = {}
+        self.subtotal_cents = 0
+        self.shipping_cents = 0
+        self.item_count = 0
+        self._touched = set()  # ids of lines changed since take_touched()
+
+    @property
+    def total_cents(self):
+        return self.subtotal_cents + self.shipping_cents
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __contains__(self, pid):
+        return pid in self._lines
+
+    def __bool__(self):
+        return bool(self._lines)
+
+    def get(self, pid):
+        return self._lines.get(pid)
+
+    def items(self):
+        return self._lines.items()
+
+    def values(self):
+        return self._lines.values()
+
+    def _apply(self, line, sign):
+        self.subtotal_cents += sign * line["price_cents"] * line["qty"]
+        self.shipping_cents += sign * line["shipping_cents"] * line["qty"]
+        self.item_count += sign * line["qty"]
+
+    def take_touched(self):
+        """Ids of the lines added, changed or removed since the last call."""
+        touched, self._touched = self._touched, set()
+        return touched
+
+    def set_qty(self, p, qty):
+        """Set the quantity for product `p` (0 removes it). Returns True if stock clamped it."""
+        pid = p["id"]
+        self._touched.add(pid)
+        qty = int(qty)
+        stock = p.get("stock", None)
+        clamped = stock is not None and qty > stock
+        if clamped:
+            qty = stock
+        line = self._lines.get(pid)
+        if line is not None:
+            self._apply(line, -1)
+        if qty <= 0:
+            self._lines.pop(pid, None)
+            return clamped
+        if line is None or line["product"] is not p:
+            line = self._lines[pid] = {"product": p, "qty": qty,
+                                       "price_cents": to_cents(p.get("price", 0)),
+                                       "shipping_cents": to_cents(p.get("shipping", 0))}
+        line["qty"] = qty
+        self._apply(line, +1)
+        return clamped
+
+    def add(self, p, qty=1):
+        line = self._lines.get(p["id"])
+        return self.set_qty(p, (line["qty"] if line else 0) + qty)
+
+    def change_qty(self, pid, delta):
+        line = self._lines.get(pid)
+        if line is None:
+            return False
+        return self.set_qty(line["product"], line["qty"] + int(delta))
+
+    def remove(self, pid):
+        line = self._lines.pop(pid, None)
+        if line is not None:
+            self._touched.add(pid)
+            self._apply(line, -1)
+
+    def add_many(self, lines):
+        """Add (product, qty) pairs; returns the ids that were clamped to stock."""
+        return [p["id"] for p, qty in lines if self.add(p, qty)]
+
+    def set_many(self, lines):
+        return [p["id"] for p, qty in lines if self.set_qty(p, qty)]
+
+    def clear(self):
+        self._touched.update(self._lines)
+        self._lines.clear()
+        self.subtotal_cents = self.shipping_cents = self.item_count = 0
+
+    def line_total_cents(self, pid):
+        line = self._lines[pid]
+        return line["price_cents"] * line["qty"]
+
+    def reconcile(self, lookup):
+        """Re-read every line's product via lookup(pid) after the catalog changed.
+
+        Lines whose product is gone (or out of stock) are dropped; the rest
+        take the new price and shipping and are clamped to the new stock.
+        Returns (removed ids, clamped ids).
+        """
+        removed, clamped = [], []
+        self._touched.update(self._lines)
+        for pid, line in list(self._lines.items()):
+            p = lookup(pid)
+            self._apply(line, -1)
+            qty = line["qty"]
+            stock = None if p is None else p.get("stock", None)
+            if stock is not None and qty > stock:
+                qty = stock
+                clamped.append(pid)
+            if p is None or qty <= 0:
+                del self._lines[pid]
+                removed.append(pid)
+                continue
+            line.update(product=p, qty=qty, price_cents=to_cents(p.get("price", 0)),
+                        shipping_cents=to_cents(p.get("shipping", 0)))
+            self._apply(line, +1)
+        return removed, [pid for pid in clamped if pid not in removed]
+
+
+# ---------- Orders ----------
+# Placed orders live in SQLite (WAL) in the data dir: unlike the catalog cache, they can't be refetched
+ORDERS_DATA_DIR = os.environ.get(
+    "EMA_JOHN_DATA_DIR", os.path.join(os.path.expanduser("~"), ".local", "share", "ema_john"))
+ORDERS_DB = os.environ.get("EMA_JOHN_ORDERS_DB") or os.path.join(ORDERS_DATA_DIR, "orders.sqlite3")
+ORDERS_PAGE_SIZE = 20
+# Checkouts placed within this window are written in one transaction
+ORDERS_FLUSH_MS = 50
+# Product names listed per order in the history table
+ORDER_SUMMARY_LINES = 3
+
+# sort label -> (column, descending); ties go by order id in the same direction
+ORDER_SORTS = {
+    "Newest first": ("placed_at", True),
+    "Oldest first": ("placed_at", False),
+    "Total: High → Low": ("total_cents", True),
+    "Total: Low → High": ("total_cents", False),
+    "Most items": ("item_count", True),
+}
+
+# orders: dicts (id, placed_at, item_count, ..._cents, lines); total: the customer's order count
+OrderPage = namedtuple("OrderPage", "orders total has_prev has_next")
+
+ORDERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    customer TEXT NOT NULL,
+    placed_at REAL NOT NULL,
+    item_count INTEGER NOT NULL,
+    subtotal_cents INTEGER NOT NULL,
+    shipping_cents INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_by_placed ON orders (customer, placed_at, id);
+CREATE INDEX IF NOT EXISTS orders_by_total ON orders (customer, total_cents, id);
+CREATE INDEX IF NOT EXISTS orders_by_items ON orders (customer, item_count, id);
+CREATE TABLE IF NOT EXISTS order_lines (
+    order_id INTEGER NOT NULL REFERENCES orders (id),
+    product_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    price_cents INTEGER NOT NULL,
+    shipping_cents INTEGER NOT NULL,
+    PRIMARY KEY (order_id, product_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS customers (
+    customer TEXT PRIMARY KEY,
+    order_count INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+ORDER_COLUMNS = ("id", "placed_at", "item_count", "subtotal_cents", "shipping_cents", "total_cents")
+
+
+class OrderStore:
+    """Placed orders in SQLite, read back one page at a time.
+
+    place() only queues the order; a flush shortly after writes everything
+    queued in one transaction (reads flush first, so a new order is always
+    in the history) and resolves each order's Future with its id, or with
+    the error if the transaction failed and nothing in it was stored.
+    Pages are keyset-paginated over an index per sort column, so page 500
+    costs what page 1 does, and the per-customer order count is kept in its
+    own table instead of counted.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or ORDERS_DB
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # one connection writes, one reads: under WAL neither waits for the other
+        self._writer = self._connect()
+        self._writer.executescript(ORDERS_SCHEMA)
+        self._reader = self._writer if self.path == ":memory:" else self._connect()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock() if self._reader is not self._writer else self._write_lock
+        self._pending = []
+        self._timer = None
+        self.flushes = 0
+        self.written = 0
+
+    def _connect(self):
+        import sqlite3  # only once orders are placed or browsed
+
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # durable across app crashes; WAL keeps it consistent
+        return conn
+
+    def place(self, customer, cart):
+        """Queue the cart as an order for `customer`; it is written within ORDERS_FLUSH_MS.
+
+        Returns a Future for the new order's id (it raises if the write failed).
+        """
+        lines = [(pid, line["product"].get("name", ""), line["qty"],
+                  line["price_cents"], line["shipping_cents"]) for pid, line in cart.items()]
+        order = (customer, time.time(), cart.item_count, cart.subtotal_cents,
+                 cart.shipping_cents, cart.total_cents, lines)
+        written = Future()
+        with self._write_lock:
+            self._pending.append((order, written))
+            if self._timer is None:
+                self._timer = threading.Timer(ORDERS_FLUSH_MS / 1000, self._flush_logged)
+                self._timer.daemon = True
+                self._timer.start()
+        return written
+
+    def _flush_logged(self):
+        # timer and read paths: the orders' Futures already carry the error
+        try:
+            self.flush()
+        except Exception as e:
+            print("Warning: failed to write orders:", e)
+
+    def flush(self):
+        """Write every queued order in one transaction; returns how many."""
+        with self._write_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            conn = self._writer
+            lines, counts, ids = [], {}, []
+            try:
+                with conn:
+                    for (*header, order_lines), _ in batch:
+                        order_id = conn.execute(
+                            "INSERT INTO orders (customer, placed_at, item_count, subtotal_cents,"
+                            " shipping_cents, total_cents) VALUES (?, ?, ?, ?, ?, ?)", header).lastrowid
+                        ids.append(order_id)
+                        lines.extend((order_id, *line) for line in order_lines)
+                        counts[header[0]] = counts.get(header[0], 0) + 1
+                    conn.executemany("INSERT INTO order_lines VALUES (?, ?, ?, ?, ?, ?)", lines)
+                    conn.executemany(
+                        "INSERT INTO customers VALUES (?, ?) ON CONFLICT (customer)"
+                        " DO UPDATE SET order_count = order_count + excluded.order_count",
+                        counts.items())
+            except Exception as e:
+                # rolled back: every order in the batch reports the failure to whoever placed it
+                for _, written in batch:
+                    written.set_exception(e)
+                raise
+            for (_, written), order_id in zip(batch, ids):
+                written.set_result(order_id)
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    def page(self, customer, sort="Newest first", after=None, before=None, limit=None):
+        """One page of `customer`'s orders in `sort` order.
+
+        after / before are the last / first order of the page being left
+        (Next / Prev); neither means the first page.
+        """
+        self._flush_logged()
+        limit = limit or ORDERS_PAGE_SIZE
+        column, descending = ORDER_SORTS[sort]
+        forward = before is None
+        # Prev walks the index the other way from `before`, then flips the rows back
+        desc = descending == forward
+        where, args = "customer = ?", [customer]
+        cursor = after if forward else before
+        if cursor is not None:
+            where += f" AND ({column}, id) {'<' if desc else '>'} (?, ?)"
+            args += [cursor[column], cursor["id"]]
+        direction = "DESC" if desc else "ASC"
+        sql = (f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders WHERE {where}"
+               f" ORDER BY {column} {direction}, id {direction} LIMIT ?")
+        with self._read_lock:
+            rows = self._reader.execute(sql, [*args, limit + 1]).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            if not forward:
+                rows.reverse()
+            orders = [dict(zip(ORDER_COLUMNS, row), lines=[]) for row in rows]
+            self._attach_lines(orders)
+            row = self._reader.execute(
+                "SELECT order_count FROM customers WHERE customer = ?", (customer,)).fetchone()
+        total = row[0] if row else 0
+        if forward:
+            return OrderPage(orders, total, after is not None, more)
+        return OrderPage(orders, total, more, True)
+
+    def _attach_lines(self, orders):
+        if not orders:
+            return
+        by_id = {o["id"]: o for o in orders}
+        marks = ", ".join("?" * len(by_id))
+        for order_id, name, qty in self._reader.execute(
+                f"SELECT order_id, name, qty FROM order_lines WHERE order_id IN ({marks})", list(by_id)):
+            by_id[order_id]["lines"].append((name, qty))
+
+    def close(self):
+        self.flush()
+        for conn in {self._writer, self._reader}:
+            conn.close()
+
+
+# ---------- Keyed rendering ----------
+# Reuse controls by product id and mutate only changed fields (False: rebuild every render)
+KEYED_RENDER = True
+# Cart changes touching more lines than this (checkout, a catalog refresh) reconcile the whole list
+CART_PATCH_MAX = 32
+
+
+def set_if_changed(control, attr, value):
+    """Assign control.attr only when it differs, so unchanged controls stay clean."""
+    if getattr(control, attr) != value:
+        setattr(control, attr, value)
+        return True
+    return False
+
+
+def update_mounted(page, *controls):
+    # send only these controls; ones not on the page go out with their next mount
+    mounted = [c for c in controls if c.page is not None]
+    if mounted:
+        page.update(*mounted)
+
+
+class KeyedList:
+    """Keeps one control per key in a container and patches it in place.
+
+    `reconcile` builds controls only for new keys, runs `patch(control,
+    item)` on existing ones (it mutates what changed and returns True if
+    anything did) and drops controls whose key went away. It returns the
+    controls that need an update: the patched ones, or the container
+    itself when membership or order changed.
+    """
+
+    def __init__(self, container, key, build, patch, empty=None):
+        self.container = container
+        self.key = key
+        self.build = build
+        self.patch = patch
+        self.empty = empty  # shown when there are no items
+        self.controls = {}  # key -> control
+        self.created = 0
+
+    def reconcile(self, items):
+        if not KEYED_RENDER:
+            self.controls.clear()
+        wanted = []
+        dirty = []
+        seen = {}
+        for item in items:
+            k = self.key(item)
+            control = self.controls.get(k)
+            if control is None:
+                control = self.build(item)
+                self.created += 1
+            elif self.patch(control, item):
+                dirty.append(control)
+            seen[k] = control
+            wanted.append(control)
+        self.controls = seen
+        if not wanted and self.empty is not None:
+            wanted.append(self.empty)
+        current = self.container.controls
+        if len(wanted) != len(current) or any(a is not b for a, b in zip(wanted, current)):
+            self.container.controls[:] = wanted
+            return [self.container]  # its update also carries the patched children
+        return dirty
+
+    def update(self, items):
+        """Like reconcile, but only for the given keys: {key: item, or None to drop it}.
+
+        New keys are appended, so this suits containers kept in insertion
+        order (the cart). The container is only dirtied when a key is added
+        or dropped; otherwise just the patched controls are returned.
+        """
+        current = self.container.controls
+        dirty = []
+        resized = False
+        for k, item in items.items():
+            control = self.controls.get(k)
+            if item is None:
+                if control is not None:
+                    del self.controls[k]
+                    current.remove(control)
+                    resized = True
+            elif control is None:
+                control = self.controls[k] = self.build(item)
+                self.created += 1
+                current.append(control)
+                resized = True
+            elif self.patch(control, item):
+                dirty.append(control)
+        if not resized:
+            return dirty
+        if self.empty is not None:
+            if self.controls and current[0] is self.empty:
+                del current[0]
+            elif not self.controls and not current:
+                current.append(self.empty)
+        return [self.container]
+
+
+# ---------- Resize handling ----------
+# At most one resize is handled per this many ms (the last event in a burst always is)
+RESIZE_THROTTLE_MS = 100
+
+# How product cards are laid out at one breakpoint (products column share of the page)
+CardLayout = namedtuple("CardLayout", "share img_size stacked item_height")
+
+
+class Throttle:
+    """Calls fn at most once per interval, always with the latest arguments.
+
+    The first call in a quiet period runs immediately; calls inside the
+    interval are collapsed into one trailing call when it ends.
+    """
+
+    def __init__(self, fn, interval_ms):
+        self.fn = fn
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._last = float("-inf")
+        self._timer = None
+        self._args = ()
+        self.calls = 0
+        self.runs = 0
+
+    def __call__(self, *args):
+        with self._lock:
+            self.calls += 1
+            self._args = args
+            if self._timer is not None:
+                return
+            wait = self._last + self.interval - time.monotonic()
+            if wait > 0:
+                self._timer = threading.Timer(wait, self._fire)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+            self._last = time.monotonic()
+        self.runs += 1
+        self.fn(*args)
+
+    def _fire(self):
+        with self._lock:
+            self._timer = None
+            self._last = time.monotonic()
+            args = self._args
+        self.runs += 1
+        self.fn(*args)
+
+
+# ---------- Image thumbnails ----------
+# Product images are downloaded once, resized to the sizes cards and cart rows
+# actually display, and served from an LRU-evicted disk cache.
+IMAGE_CACHE = True
+IMAGE_CACHE_DIR = os.environ.get(
+    "EMA_JOHN_IMAGE_CACHE_DIR", os.path.join(CATALOG_CACHE_DIR, "images"))
+IMAGE_CACHE_MAX_BYTES = 256 << 20
+IMAGE_PREFETCH_WORKERS = 4
+IMAGE_PREFETCH_QUEUE = 256  # pending downloads beyond this are dropped, not queued
+IMAGE_SIZE_STEP = 40        # thumbnail sizes are rounded up to a multiple of this
+CART_THUMB_SIZE = 80
+IMAGE_REFRESH_MS = 100      # downloaded thumbnails are swapped in at most this often
+IMAGE_RETRY_S = 300         # a URL that failed to download is tried again after this long
+
+
+class ImageCache:
+    """Thumbnails of remote images in a size-capped directory, least recently used evicted first.
+
+    src() never blocks: a miss returns the remote URL and queues the
+    download on a bounded pool; on_ready(url) (and every subscriber) runs
+    once the local copy exists, so the caller can swap it in. A hit is
+    the local path, or `url_prefix`/<file> when the directory is served
+    over HTTP (web sessions).
+    """
+
+    ORIGINAL = 0  # size key of the downloaded full-size image
+
+    def __init__(self, directory=None, max_bytes=None, workers=None, timeout=10, on_ready=None,
+                 url_prefix=None):
+        self.directory = directory or IMAGE_CACHE_DIR
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes or IMAGE_CACHE_MAX_BYTES
+        self.timeout = timeout
+        self._listeners = {on_ready} if on_ready else set()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> bytes, least recently used first
+        self._bytes = 0
+        self._pending = set()
+        self._failed = {}  # url -> time.monotonic() of its last failed download
+        self._used = {}    # file name -> time.time() of hits not yet written back as mtime
+        self._url_locks = {}
+        self._pool = ThreadPoolExecutor(workers or IMAGE_PREFETCH_WORKERS,
+                                        thread_name_prefix="image-cache")
+        self.downloads = 0
+        self.hits = 0
+        self.misses = 0
+        self._scan()
+
+    def _scan(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        found = []
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._bytes += size
+
+    @staticmethod
+    def thumb_size(size):
+        return -(-int(size) // IMAGE_SIZE_STEP) * IMAGE_SIZE_STEP
+
+    @staticmethod
+    def cacheable(url):
+        return isinstance(url, str) and url.startswith(("http://", "https://"))
+
+    def _name(self, url, size):
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:24]
+        return f"{digest}_{size}"
+
+    def path(self, url, size):
+        """Local path of the cached image, or None; a hit counts as a use."""
+        name = self._name(url, size)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+            self._used[name] = time.time()
+        return os.path.join(self.directory, name)
+
+    def _save_recency(self):
+        # recency survives restarts via mtime; written in batches off the UI thread
+        with self._lock:
+            used, self._used = self._used, {}
+        for name, t in used.items():
+            try:
+                os.utime(os.path.join(self.directory, name), (t, t))
+            except OSError:
+                pass
+
+    def src(self, url, size):
+        """What an ft.Image should show for `url` at `size` px right now."""
+        if not self.cacheable(url):
+            return url
+        size = self.thumb_size(size) if HAVE_PIL else self.ORIGINAL
+        path = self.path(url, size)
+        if path is not None:
+            self.hits += 1
+            if self.url_prefix is not None:
+                return f"{self.url_prefix}/{os.path.basename(path)}"
+            return path
+        self.misses += 1
+        self._schedule(url, size)
+        return url
+
+    def prefetch(self, urls, size):
+        size = self.thumb_size(size) if HAVE_PIL else self.ORIGINAL
+        for url in urls:
+            if self.cacheable(url) and self._name(url, size) not in self._entries:
+                self._schedule(url, size)
+
+    def _schedule(self, url, size):
+        key = (url, size)
+        with self._lock:
+            if key in self._pending or len(self._pending) >= IMAGE_PREFETCH_QUEUE:
+                return
+            failed = self._failed.get(url)
+            if failed is not None:
+                if time.monotonic() - failed < IMAGE_RETRY_S:
+                    return
+                del self._failed[url]
+            self._pending.add(key)
+        try:
+            self._pool.submit(self._fetch, url, size)
+        except RuntimeError:  # pool shut down
+            with self._lock:
+                self._pending.discard(key)
+
+    def _fetch(self, url, size):
+        try:
+            data = self._original(url)
+            if size != self.ORIGINAL and self.path(url, size) is None:
+                self._write(self._name(url, size), self._thumbnail(data, size))
+        except Exception as e:
+            with self._lock:
+                self._failed[url] = time.monotonic()
+            print("Warning: failed to cache image", url, e)
+            return
+        finally:
+            with self._lock:
+                self._pending.discard((url, size))
+        for listener in list(self._listeners):
+            listener(url)
+
+    def _original(self, url):
+        # every size of one image is cut from a single download
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            path = self.path(url, self.ORIGINAL)
+            if path is not None:
+                try:
+                    with open(path, "rb") as f:
+                        return f.read()
+                except OSError:
+                    pass
+            req = urllib.request.Request(url, headers={"User-Agent": "ema-john/1.0"})
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                data = resp.read()
+            self.downloads += 1
+            self._write(self._name(url, self.ORIGINAL), data)
+            return data
+
+    @staticmethod
+    def _thumbnail(data, size):
+        from PIL import Image as PILImage
+
+        with PILImage.open(io.BytesIO(data)) as im:
+            im.thumbnail((size, size))
+            out = io.BytesIO()
+            if im.mode in ("RGBA", "LA", "P"):
+                im.save(out, "PNG", optimize=True)
+            else:
+                im.convert("RGB").save(out, "JPEG", quality=85)
+        return out.getvalue()
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(self.directory, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+        self._save_recency()
+
+    def subscribe(self, on_ready):
+        """Also call on_ready(url) when a download lands (one cache, many sessions)."""
+        self._listeners.add(on_ready)
+
+    def unsubscribe(self, on_ready):
+        self._listeners.discard(on_ready)
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._bytes, "pending": len(self._pending),
+                    "downloads": self.downloads, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._save_recency()
+
+
+# ---------- Server mode ----------
+# One process, many browser sessions: the catalog, its indexes and the image
+# cache are loaded once and shared read-only; a session holds its cart and view.
+SERVER_MODE = os.environ.get("EMA_JOHN_SERVER", "") not in ("", "0")
+SERVER_PORT = int(os.environ.get("EMA_JOHN_PORT") or 8550)
+# A browser can't load server paths: the shared thumbnails live in (and are served from)
+# the Flet assets directory and cards point at them by URL. It holds up to
+# IMAGE_CACHE_MAX_BYTES of downloads, so it defaults to the cache, not the source tree.
+ASSETS_DIR = os.environ.get("FLET_ASSETS_DIR") or os.path.join(CATALOG_CACHE_DIR, "assets")
+SERVER_IMAGE_SUBDIR = "thumbs"
+
+CatalogSnapshot = namedtuple("CatalogSnapshot", "products index engine version")
+
+
+class SharedCatalog:
+    """Process-wide catalog: built once, never mutated, replaced atomically.
+
+    A refresh builds the new store, index and engine off to the side and
+    publishes them with a single reference swap, so a session sees the
+    old catalog or the new one, never a mix; unlike a desktop session's
+    catalog it is never patched in place, since readers may hold it.
+    Sessions query through engine.fork() so their query caches stay their own.
+    """
+
+    def __init__(self, source=CATALOG_SOURCE, cache=None, loader=None):
+        self.source = source
+        self.cache = cache
+        self.loader = loader  # () -> products; default: disk cache, then safe_load_products
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._listeners = set()
+        self.version = 0
+
+    def build(self, products):
+        store = ProductStore(products)
+        index = SearchIndex(store)
+        engine = FilterSortEngine(store, index)
+        engine.facets.bitmaps()  # built now, so no session ever builds them concurrently
+        return CatalogSnapshot(store, index, engine, self.version + 1)
+
+    def get(self):
+        """The current snapshot, loading it on first use (concurrent first callers wait)."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    products, revalidate = self._load()
+                    self._publish(self.build(products))
+                    if revalidate:
+                        self.refresh_in_background()
+                snapshot = self._snapshot
+        return snapshot
+
+    def _load(self):
+        if self.loader is not None:
+            return self.loader(), False
+        cached = self.cache.load() if self.cache else None
+        if cached is not None:
+            return cached, True
+        return safe_load_products(self.source, cache=self.cache), False
+
+    def _publish(self, snapshot):
+        self.version = snapshot.version
+        self._snapshot = snapshot
+
+    def replace(self, products):
+        """Publish a catalog built from `products` and tell every subscribed session.
+
+        Listeners get (snapshot, delta) so they only redo what changed; an
+        identical catalog isn't rebuilt at all.
+        """
+        products = list(products)
+        old = self._snapshot
+        delta = diff_catalog(old.products, products) if old is not None else None
+        if delta is not None and not any(delta):
+            return old
+        snapshot = self.build(products)
+        with self._lock:
+            snapshot = snapshot._replace(version=self.version + 1)
+            self._publish(snapshot)
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot, delta)
+            except Exception as e:
+                print("Warning: session failed to take the new catalog:", e)
+        return snapshot
+
+    def refresh(self):
+        """Revalidate against the source now; True if a new catalog was published."""
+        products = fetch_catalog(self.source, self.cache)
+        if products is None:
+            return False
+        self.replace(products)
+        return True
+
+    def refresh_in_background(self):
+        return refresh_catalog_in_background(self.replace, self.source, cache=self.cache)
+
+    def start_refreshing(self, interval=None):
+        """Check the source every `interval` s (CATALOG_REFRESH_S) for the life of the process."""
+        return CatalogRefresher(self.replace, interval, self.source, self.cache).start()
+
+    def subscribe(self, on_replace):
+        self._listeners.add(on_replace)
+
+    def unsubscribe(self, on_replace):
+        self._listeners.discard(on_replace)
+
+    @property
+    def sessions(self):
+        return len(self._listeners)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_catalog():
+    """The process's SharedCatalog (server mode)."""
+    with _shared_lock:
+        if "catalog" not in _shared:
+            _shared["catalog"] = SharedCatalog(
+                CATALOG_SOURCE, CatalogCache() if CATALOG_CACHE else None)
+        return _shared["catalog"]
+
+
+def shared_image_cache():
+    """The process's ImageCache (server mode); sessions subscribe to its downloads."""
+    with _shared_lock:
+        if "images" not in _shared:
+            _shared["images"] = ImageCache(os.path.join(ASSETS_DIR, SERVER_IMAGE_SUBDIR),
+                                           url_prefix=f"/{SERVER_IMAGE_SUBDIR}")
+        return _shared["images"]
+
+
+def shared_order_store():
+    """The process's OrderStore (server mode): checkouts from all sessions share its batches."""
+    with _shared_lock:
+        if "orders" not in _shared:
+            _shared["orders"] = OrderStore()
+        return _shared["orders"]
+
+
+def customer_id(page):
+    """Whose order history a session sees: the one local user, or this browser in server mode."""
+    if not SERVER_MODE:
+        return "local"
     try:
-        from flet_core import ImageFit  # type: ignore
-        FIT_CONTAIN = ImageFit.CONTAIN
+        cid = page.client_storage.get("ema_john.customer")
+        if not cid:
+            cid = os.urandom(8).hex()
+            page.client_storage.set("ema_john.customer", cid)
+        return cid
     except Exception:
-        FIT_CONTAIN = "contain"
+        return getattr(page, "session_id", None) or "local"
 
+# Virtualized product list: only the visible window (+ overscan) is built as
+# controls, and more of the catalog is paged in as the user scrolls.
+VIRTUAL_LIST = True
+VIRTUAL_PAGE_SIZE = 40
+VIRTUAL_OVERSCAN = 6
 
-def safe_load_products(url=PRODUCTS_JSON_URL, timeout=8):
-    try:
-        with urllib.request.urlopen(url, timeout=timeout) as resp:
-            data = json.loads(resp.read().decode())
-            cleaned = []
-            for i, p in enumerate(data):
-                cleaned.append({
-                    "id": str(p.get("id", i)),
-                    "name": p.get("name", "Unnamed product"),
-                    "price": float(p.get("price", 0)),
-                    "img": p.get("img", "") or p.get("image", ""),
-                    "category": p.get("category", ""),
-                    "seller": p.get("seller", ""),
-                    "stock": int(p.get("stock", p.get("quantity", 10) or 0)),
-                    "ratings": float(p.get("ratings", p.get("rating", 0)) or 0),
-                    "ratingsCount": int(p.get("ratingsCount", p.get("ratingCount", 0) or 0)),
-                    "shipping": float(p.get("shipping", 0) or 0),
-                })
-            return cleaned
-    except Exception as e:
-        print("Warning: failed to load remote products:", e)
-        return [
-            {"id": "f1", "name": "Headphones", "price": 19.99,
-             "img": "https://via.placeholder.com/220x160?text=Headphones", "stock": 10, "ratings": 4.2, "ratingsCount": 34, "shipping": 2.5},
-            {"id": "f2", "name": "Mug", "price": 7.5,
-             "img": "https://via.placeholder.com/220x160?text=Mug", "stock": 15, "ratings": 4.6, "ratingsCount": 80, "shipping": 1.5},
-        ]
 
+class VirtualProductList:
+    """Windowed view of a product sequence inside an ft.ListView.
 
-def star_str(rating):
-    full = "★" * int(math.floor(rating))
-    empty = "☆" * max(0, 5 - int(math.floor(rating)))
-    return full + empty
+    Cards scrolled out of the window are rebound to the newly visible
+    products instead of being rebuilt. Spacers above and below the window
+    keep the scroll extent equal to the number of loaded items.
+    bind_card(card, p) returns True if it changed anything, so set_items
+    can tell the caller when there is nothing to send.
+    """
+
+    def __init__(self, listview, build_card, bind_card, item_height, viewport_height,
+                 page_size=VIRTUAL_PAGE_SIZE, overscan=VIRTUAL_OVERSCAN, prefetch=None):
+        self.listview = listview
+        self.build_card = build_card
+        self.bind_card = bind_card
+        self.prefetch = prefetch  # called with the next page of items after the window
+        self.item_height = max(1, item_height)
+        self.viewport_height = max(1, viewport_height)
+        self.page_size = page_size
+        self.overscan = overscan
+        self.top_spacer = ft.Container(height=0)
+        self.bottom_spacer = ft.Container(height=0)
+        self._by_key = {}   # product id -> card currently showing it
+        self._spare = []    # built cards not in the window, reused before building more
+        self.created = 0
+        self.items = []
+        self.loaded = 0     # items paged in so far
+        self.start = 0      # index of the first built card
+
+    def window_size(self):
+        return int(math.ceil(self.viewport_height / self.item_height)) + 2 * self.overscan
+
+    def reset_pool(self, item_height=None):
+        # cards are laid out for one image size / breakpoint; drop them when that changes
+        self._by_key = {}
+        self._spare = []
+        if item_height:
+            self.item_height = max(1, item_height)
+
+    def set_items(self, items, keep_position=False):
+        # keep_position: same list, grown (e.g. while the catalog streams in)
+        self.items = items
+        first_page = min(len(items), max(self.page_size, self.window_size()))
+        if keep_position:
+            self.loaded = max(first_page, min(self.loaded, len(items)))
+        else:
+            self.loaded = first_page
+            self.start = 0
+        return self._layout()
 
+    def _layout(self):
+        # returns whether any control in the list changed
+        end = min(self.loaded, self.start + self.window_size())
+        visible = self.items[self.start:end]
+        if not KEYED_RENDER:
+            self.reset_pool()
+        keys = {p["id"] for p in visible}
+        # products still in the window keep their card; cards that scrolled out get rebound
+        spare = self._spare + [c for k, c in self._by_key.items() if k not in keys]
+        by_key = {}
+        cards = []
+        changed = False
+        for p in visible:
+            card = self._by_key.get(p["id"])
+            if card is None or p["id"] in by_key:
+                card = spare.pop() if spare else None
+                if card is None:
+                    card = self.build_card(p)
+                    self.created += 1
+            changed = self.bind_card(card, p) or changed  # only touches fields that differ
+            by_key[p["id"]] = card
+            cards.append(card)
+        self._by_key = by_key
+        self._spare = spare
+        changed = set_if_changed(self.top_spacer, "height", self.start * self.item_height) or changed
+        changed = set_if_changed(self.bottom_spacer, "height", (self.loaded - end) * self.item_height) or changed
+        controls = [self.top_spacer, *cards, self.bottom_spacer]
+        current = self.listview.controls
+        if len(controls) != len(current) or any(a is not b for a, b in zip(controls, current)):
+            self.listview.controls[:] = controls
+            changed = True
+        if self.prefetch is not None:
+            self.prefetch(self.items[end:end + self.page_size])
+        return changed
 
-main_content = ft.Column(expand=True, spacing=12)
+    def scroll_to(self, pixels, max_extent=None):
+        """Move the window to scroll offset `pixels`; returns True when controls changed."""
+        changed = False
+        near_end = max_extent is not None and pixels >= max_extent - self.viewport_height
+        if near_end and self.loaded < len(self.items):
+            self.loaded = min(len(self.items), self.loaded + self.page_size)
+            changed = True
+        first = max(0, int(pixels // self.item_height) - self.overscan)
+        first = min(first, max(0, self.loaded - self.window_size()))
+        if first != self.start:
+            self.start = first
+            changed = True
+        if changed:
+            self._layout()
+        return changed
+
+    def on_scroll(self, e):
+        if getattr(e, "viewport_dimension", None):
+            self.viewport_height = e.viewport_dimension
+        if self.scroll_to(float(e.pixels or 0), getattr(e, "max_scroll_extent", None)):
+            self.listview.update()
 
 
 def main(page: ft.Page):
@@ -67,11 +2605,47 @@ def main(page: ft.Page):
         page.bgcolor = COLORS.WHITE
     except Exception:
         pass
+    METRICS.instrument_page(page)
+    if METRICS.enabled:
+        OPEN_PAGES.add(page)
+
+    # per-session content area (pages swap what's inside it)
+    main_content = ft.Column(expand=True, spacing=12)
 
-    products = safe_load_products()
-    cart = {}
+    # start from the disk cache when there is one and revalidate it after the first render
+    catalog_cache = CatalogCache() if CATALOG_CACHE and not SERVER_MODE else None
+    cached = None
+    if SERVER_MODE:
+        # the process-wide catalog: this session only holds a view onto it
+        shared = shared_catalog()
+        snapshot = shared.get()
+        products, search_index = snapshot.products, snapshot.index
+    elif ASYNC_CATALOG_LOAD:
+        # streamed in by load_catalog_progressively once the shell has rendered
+        products = ProductStore()
+    else:
+        cached = catalog_cache.load() if catalog_cache else None
+        products = ProductStore(
+            cached if cached is not None else safe_load_products(CATALOG_SOURCE, cache=catalog_cache))
+    if not SERVER_MODE:
+        search_index = SearchIndex(products)
+    cart = Cart()
     cart_count_txt = ft.Text(f"({len(cart)})")
 
+    # images start out remote and switch to local thumbnails as they're cached
+    def on_image_ready(url):
+        images_ready()
+
+    image_cache = None
+    if IMAGE_CACHE and SERVER_MODE:
+        image_cache = shared_image_cache()
+        image_cache.subscribe(on_image_ready)
+    elif IMAGE_CACHE:
+        image_cache = ImageCache(on_ready=on_image_ready)
+
+    def image_src(url, size):
+        return image_cache.src(url, size) if image_cache is not None else url
+
     # Controls
     search_input = ft.TextField(
         hint_text="Search products...", col={"md": 10},)
@@ -90,108 +2664,203 @@ def main(page: ft.Page):
     shipping_txt = ft.Text("Shipping: €0.00")
     total_txt = ft.Text("Total: €0.00", weight=ft.FontWeight.BOLD)
 
+    product_count_txt = ft.Text("", color=COLORS.GREY)
+    loading_row = ft.Row([ft.ProgressRing(width=16, height=16, stroke_width=2),
+                          ft.Text("Loading products...", color=COLORS.GREY)],
+                         spacing=8, visible=False)
+
     # Use ListView for product list to keep existing behaviour
     products_listview = ft.ListView(expand=True, spacing=10, padding=6)
     cart_listview = ft.ListView(expand=True, spacing=6, padding=6)
 
     # Cart helpers (kept minimal)
     def recalc_totals():
-        subtotal = sum(e["product"]["price"] * e["qty"] for e in cart.values())
-        shipping = sum(e["product"].get("shipping", 0) * e["qty"]
-                       for e in cart.values())
-        subtotal_txt.value = f"Subtotal: €{subtotal:,.2f}"
-        shipping_txt.value = f"Shipping: €{shipping:,.2f}"
-        total_txt.value = f"Total: €{(subtotal + shipping):,.2f}"
+        # the cart keeps its totals current; this only formats them
+        changed = [t for t, v in ((subtotal_txt, f"Subtotal: {format_cents(cart.subtotal_cents)}"),
+                                  (shipping_txt, f"Shipping: {format_cents(cart.shipping_cents)}"),
+                                  (total_txt, f"Total: {format_cents(cart.total_cents)}"))
+                   if set_if_changed(t, "value", v)]
+        return changed
+
+    def notify(message):
+        try:
+            page.open(ft.SnackBar(ft.Text(message)))
+        except Exception:
+            pass
+
+    def notify_stock_limit():
+        notify("Reached available stock limit")
 
     # --- CHANGES: add change_qty and improved refresh_cart_ui (image + +/- buttons) ---
     def change_qty(pid, delta):
         """Adjust quantity for product id `pid` by `delta` (±1). Remove item when qty <= 0."""
-        entry = cart.get(pid)
-        if not entry:
+        if pid not in cart:
             return
-        # enforce integer
-        entry["qty"] = int(entry["qty"]) + int(delta)
-        # respect stock if available
-        stock = entry["product"].get("stock", None)
-        if stock is not None and entry["qty"] > stock:
-            entry["qty"] = stock
-            # optional: inform user (kept minimal per instructions)
-            try:
-                page.snack_bar.open = True
-                page.snack_bar.content = ft.Text(
-                    "Reached available stock limit")
-                page.update()
-            except Exception:
-                pass
-        if entry["qty"] <= 0:
-            del cart[pid]
+        # the cart clamps to stock; tell the user when it did
+        if cart.change_qty(pid, delta):
+            notify_stock_limit()
         refresh_cart_ui()
 
-    def refresh_cart_ui():
-        cart_listview.controls.clear()
-        if not cart:
-            cart_listview.controls.append(
-                ft.Text("Your cart is empty", italic=True))
+    def build_cart_row(item):
+        pid, entry = item
+        p = entry["product"]
+        q = entry["qty"]
+
+        # Left: small image thumbnail
+        img = ft.Image(src=image_src(p.get("img", ""), CART_THUMB_SIZE), width=80,
+                       height=60, fit=FIT_CONTAIN)
+
+        # Middle column: truncated name + unit price
+        name_txt = ft.Text(cart_display_name(p), max_lines=1,
+                           overflow=ft.TextOverflow.ELLIPSIS)
+        price_txt = ft.Text(format_cents(entry["price_cents"]), size=12)
+        name_price = ft.Column([name_txt, price_txt], tight=True)
+
+        # Qty controls (use default arg in lambda to avoid closure capture)
+        qty_txt = ft.Text(str(q))
+        qty_controls = ft.Row(
+            [
+                ft.IconButton(
+                    ft.Icons.REMOVE, on_click=lambda e, pid=pid: change_qty(pid, -1)),
+                qty_txt,
+                ft.IconButton(ft.Icons.ADD, on_click=lambda e,
+                              pid=pid: change_qty(pid, +1)),
+            ],
+            alignment=ft.MainAxisAlignment.CENTER,
+            spacing=4,
+        )
+
+        # Right: line total
+        line_total = ft.Text(format_cents(entry["price_cents"] * q))
+
+        # Construct row
+        row = ft.Row(
+            [img, name_price, qty_controls, line_total],
+            alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+        )
+        row.data = {"image": img, "name": name_txt, "price": price_txt,
+                    "qty": qty_txt, "line_total": line_total,
+                    "url": p.get("img", ""), "thumb": CART_THUMB_SIZE}
+        return row
+
+    def cart_display_name(p):
+        # Truncate name to 10 characters (add ellipsis when longer)
+        raw_name = p.get("name", "Unnamed")
+        return (raw_name[:10] + "...") if len(raw_name) > 10 else raw_name
+
+    def patch_cart_row(row, item):
+        _, entry = item
+        p = entry["product"]
+        q = entry["qty"]
+        refs = row.data
+        refs["url"] = p.get("img", "")
+        changed = False
+        for control, attr, value in (
+                (refs["image"], "src", image_src(refs["url"], refs["thumb"])),
+                (refs["name"], "value", cart_display_name(p)),
+                (refs["price"], "value", format_cents(entry["price_cents"])),
+                (refs["qty"], "value", str(q)),
+                (refs["line_total"], "value", format_cents(entry["price_cents"] * q))):
+            changed = set_if_changed(control, attr, value) or changed
+        return changed
+
+    cart_rows = KeyedList(cart_listview, key=lambda item: item[0],
+                          build=build_cart_row, patch=patch_cart_row,
+                          empty=ft.Text("Your cart is empty", italic=True))
+
+    @METRICS.timed("refresh_cart_ui")
+    def refresh_cart_ui(full=False):
+        # a +/- click touches one line: patch that row, not every row in the cart
+        touched = cart.take_touched()
+        if full or not KEYED_RENDER or len(touched) > CART_PATCH_MAX:
+            dirty = cart_rows.reconcile(cart.items())
         else:
-            for pid, entry in cart.items():
-                p = entry["product"]
-                q = entry["qty"]
-
-                # Left: small image thumbnail
-                img = ft.Image(src=p.get("img", ""), width=80,
-                               height=60, fit=FIT_CONTAIN)
-
-                # Truncate name to 25 characters (add ellipsis when longer)
-                raw_name = p.get("name", "Unnamed")
-                display_name = (
-                    raw_name[:10] + "...") if len(raw_name) > 10 else raw_name
-
-                # Middle column: truncated name + unit price
-                name_price = ft.Column(
-                    [
-                        ft.Text(display_name, max_lines=1,
-                                overflow=ft.TextOverflow.ELLIPSIS),
-                        ft.Text(f"€{p.get('price', 0):,.2f}", size=12),
-                    ],
-                    tight=True,
-                )
-
-                # Qty controls (use default arg in lambda to avoid closure capture)
-                qty_controls = ft.Row(
-                    [
-                        ft.IconButton(
-                            ft.Icons.REMOVE, on_click=lambda e, pid=pid: change_qty(pid, -1)),
-                        ft.Text(str(q)),
-                        ft.IconButton(ft.Icons.ADD, on_click=lambda e,
-                                      pid=pid: change_qty(pid, +1)),
-                    ],
-                    alignment=ft.MainAxisAlignment.CENTER,
-                    spacing=4,
-                )
-
-                # Right: line total
-                line_total = ft.Text(f"€{p.get('price', 0) * q:,.2f}")
-
-                # Construct row
-                row = ft.Row(
-                    [img, name_price, qty_controls, line_total],
-                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
-                )
-                cart_listview.controls.append(row)
-
-        cart_count_txt.value = f"({len(cart)})"
-        recalc_totals()
-        page.update()
+            dirty = cart_rows.update({pid: (pid, cart.get(pid)) if pid in cart else None
+                                      for pid in touched})
+        if set_if_changed(cart_count_txt, "value", f"({len(cart)})"):
+            dirty.append(cart_count_txt)
+        dirty.extend(recalc_totals())
+        METRICS.gauge("controls.cart_list", len(cart_listview.controls))
+        update_mounted(page, *dirty)
 
     def add_to_cart(p):
-        pid = p["id"]
-        entry = cart.get(pid)
-        if entry:
-            entry["qty"] += 1
-        else:
-            cart[pid] = {"product": p, "qty": 1}
+        if cart.add(p):
+            notify_stock_limit()
         refresh_cart_ui()
 
+    # ---------- Orders ----------
+    # the database (and in server mode the browser's customer id) is only
+    # opened on the first checkout or visit to Order Review
+    orders = None
+    customer = None
+
+    def order_store():
+        nonlocal orders, customer
+        if orders is None:
+            orders = shared_order_store() if SERVER_MODE else OrderStore()
+            customer = customer_id(page)
+        return orders
+
+    checkout_lock = threading.Lock()  # a second click while one is being written is ignored
+
+    def checkout(e=None):
+        if not cart:
+            notify("Your cart is empty")
+            return
+        if not checkout_lock.acquire(blocking=False):
+            return
+        try:
+            count, total = cart.item_count, cart.total_cents
+            store = order_store()
+            # confirmed (and the cart emptied) only once the order is committed
+            try:
+                order_id = store.place(customer, cart).result()
+            except Exception as ex:
+                notify(f"Could not place your order, your cart was kept: {ex}")
+                return
+            cart.clear()
+            refresh_cart_ui()
+            notify(f"Order #{order_id} placed: {count} item(s), {format_cents(total)}")
+        finally:
+            checkout_lock.release()
+
+    # order history: one page of rows at a time, fetched from the store per page.
+    # Its controls are built with the Order Review view (build_order_review).
+    order_widths = (("Order", 70), ("Placed", 140), ("Items", 60), ("Total", 90))
+    history = {"page": None, "number": 1}
+
+    def build_order_row(order):
+        names = ", ".join(f"{qty}× {name}" for name, qty in order["lines"][:ORDER_SUMMARY_LINES])
+        if len(order["lines"]) > ORDER_SUMMARY_LINES:
+            names += f" +{len(order['lines']) - ORDER_SUMMARY_LINES} more"
+        placed = time.strftime("%Y-%m-%d %H:%M", time.localtime(order["placed_at"]))
+        values = (f"#{order['id']}", placed, str(order["item_count"]), format_cents(order["total_cents"]))
+        return ft.Row([ft.Text(v, width=w) for v, (_, w) in zip(values, order_widths)]
+                      + [ft.Text(names, expand=True, color=COLORS.GREY)])
+
+    def show_orders(after=None, before=None, number=1):
+        store = order_store()
+        result = store.page(customer, history["sort"].value or "Newest first", after, before)
+        history.update(page=result, number=number)
+        dirty = history["rows"].reconcile(result.orders)
+        pages = max(1, -(-result.total // ORDERS_PAGE_SIZE))
+        for control, attr, value in (
+                (history["prev"], "disabled", not result.has_prev),
+                (history["next"], "disabled", not result.has_next),
+                (history["label"], "value", f"Page {number} of {pages} · {result.total} orders")):
+            if set_if_changed(control, attr, value):
+                dirty.append(control)
+        update_mounted(page, *dirty)
+
+    def on_order_page(step):
+        shown = history["page"]
+        if shown is None or not shown.orders:
+            return
+        if step > 0:
+            show_orders(after=shown.orders[-1], number=history["number"] + 1)
+        else:
+            show_orders(before=shown.orders[0], number=history["number"] - 1)
+
     # ---------- Responsive image sizing logic ----------
     # ResponsiveRow col mapping used in this file:
     # products col: {"sm":12, "md":8, "xl":9}
@@ -223,32 +2892,69 @@ def main(page: ft.Page):
             img = int(max(100, min(360, available * 0.30)))
         return img
 
-    # ---------- Product card builder uses computed img_size ----------
-    def build_product_card(p, img_size):
+    # the size the last on_resized event reported, else page.width/height.
+    # (window_width/height above are only what main() asked for; they never change)
+    window_size = {}
+
+    def page_width():
+        return int(window_size.get("width") or getattr(page, "width", None)
+                   or getattr(page, "client_width", None) or 1000)
+
+    def page_height():
+        return int(window_size.get("height") or getattr(page, "height", None) or 800)
+
+    # one CardLayout per breakpoint, computed the first time the page reaches it
+    card_layouts = {}
+    current_layout = None
+
+    def layout_for(width):
+        share = products_column_share(width)
+        layout = card_layouts.get(share)
+        if layout is None:
+            img_size = compute_img_size(width)
+            stacked = share == 1.0
+            layout = card_layouts[share] = CardLayout(
+                share, img_size, stacked, estimate_card_height(img_size, stacked))
+        return layout
+
+    def active_layout():
+        nonlocal current_layout
+        if current_layout is None:
+            current_layout = layout_for(page_width())
+        return current_layout
+
+    # ---------- Product card builder uses the breakpoint's CardLayout ----------
+    def build_product_card(p, layout):
+        img_size = layout.img_size
         # image uses FIT_CONTAIN (enum or string)
+        image = ft.Image(src=image_src(p["img"], img_size), width=img_size,
+                         height=img_size, fit=FIT_CONTAIN)
         image_box = ft.Container(
-            content=ft.Image(src=p["img"], width=img_size,
-                             height=img_size, fit=FIT_CONTAIN),
+            content=image,
             padding=8,
             bgcolor=COLORS.WHITE,
             border_radius=4,
         )
+        name_txt = ft.Text(p["name"], weight=ft.FontWeight.W_600,
+                           max_lines=3, overflow=ft.TextOverflow.ELLIPSIS)
+        price_txt = ft.Text(f"€{p['price']:,.2f}", weight=ft.FontWeight.BOLD)
+        rating_txt = ft.Text(star_str(p.get("ratings", 0)) +
+                             f"  ({p.get('ratingsCount', 0)})", size=12, color=COLORS.GREY)
+        seller_txt = ft.Text(f"Seller: {p.get('seller', '-')}  •  Stock: {p.get('stock', 0)}",
+                             size=12, color=COLORS.GREY_600)
+        # the button carries its product, so rebinding the card doesn't need a new handler
+        add_btn = ft.ElevatedButton("Add to cart", icon=ft.Icons.SHOPPING_CART, on_click=lambda e: add_to_cart(e.control.data),
+                                    data=p, style=ft.ButtonStyle(bgcolor="#ffd814", padding=ft.padding.Padding(5, 11, 5, 11), color=COLORS.BLACK))
         details = ft.Column([
-            ft.Text(p["name"], weight=ft.FontWeight.W_600,
-                    max_lines=3, overflow=ft.TextOverflow.ELLIPSIS),
-            ft.Text(f"€{p['price']:,.2f}", weight=ft.FontWeight.BOLD),
-            ft.Text(star_str(p.get("ratings", 0)) +
-                    f"  ({p.get('ratingsCount', 0)})", size=12, color=COLORS.GREY),
-            ft.Text(f"Seller: {p.get('seller', '-')}  •  Stock: {p.get('stock', 0)}",
-                    size=12, color=COLORS.GREY_600),
-            ft.Row([ft.ElevatedButton("Add to cart", icon=ft.Icons.SHOPPING_CART, on_click=lambda e, prod=p: add_to_cart(prod),
-                                      style=ft.ButtonStyle(bgcolor="#ffd814", padding=ft.padding.Padding(5, 11, 5, 11), color=COLORS.BLACK))], spacing=8)
+            name_txt,
+            price_txt,
+            rating_txt,
+            seller_txt,
+            ft.Row([add_btn], spacing=8)
         ], expand=True)
 
         # Decide layout: stacked on mobile (image above details), side-by-side otherwise
-        page_w = getattr(page, "window_width", None) or getattr(
-            page, "client_width", None) or getattr(page, "width", None) or 1000
-        if products_column_share(int(page_w)) == 1.0:
+        if layout.stacked:
             # mobile: stack
             content = ft.Column([image_box, details], spacing=8)
         else:
@@ -263,37 +2969,165 @@ def main(page: ft.Page):
             border_radius=4,
             width=None,
         )
+        # keep refs so the virtual list can rebind this card to another product
+        tile.data = {"image": image, "name": name_txt, "price": price_txt,
+                     "rating": rating_txt, "seller": seller_txt, "button": add_btn,
+                     "thumb": img_size}
         return tile
 
-    def render_products(list_of_products):
-        # compute image size from current page width
-        page_w = getattr(page, "window_width", None) or getattr(
-            page, "client_width", None) or getattr(page, "width", None) or 1000
-        img_size = compute_img_size(int(page_w))
-        products_listview.controls.clear()
-        for p in list_of_products:
-            products_listview.controls.append(build_product_card(p, img_size))
+    def bind_product_card(tile, p):
+        refs = tile.data
+        refs["button"].data = p
+        changed = False
+        for control, attr, value in (
+                (refs["image"], "src", image_src(p["img"], refs["thumb"])),
+                (refs["name"], "value", p["name"]),
+                (refs["price"], "value", f"€{p['price']:,.2f}"),
+                (refs["rating"], "value", star_str(
+                    p.get("ratings", 0)) + f"  ({p.get('ratingsCount', 0)})"),
+                (refs["seller"], "value", f"Seller: {p.get('seller', '-')}  •  Stock: {p.get('stock', 0)}")):
+            changed = set_if_changed(control, attr, value) or changed
+        return changed
+
+    def estimate_card_height(img_size, stacked):
+        # image box (img + 2*8 padding) + tile padding; stacked tiles also carry the details column
+        details_h = 170
+        if stacked:
+            return img_size + 16 + 8 + details_h + 24 + 10
+        return max(img_size + 16, details_h) + 24 + 10
+
+    virtual_list = None
+    virtual_layout = None  # the CardLayout the pooled cards were built for
+    shown_products = []
+
+    def prefetch_images(items):
+        if image_cache is not None:
+            image_cache.prefetch([p["img"] for p in items], active_layout().img_size)
+
+    def refresh_images():
+        # point mounted images at thumbnails that finished downloading
+        dirty = []
+        for control in (*products_listview.controls, *cart_listview.controls):
+            refs = control.data
+            if not refs:
+                continue  # spacers, empty-cart text
+            url = refs["button"].data["img"] if "button" in refs else refs["url"]
+            if set_if_changed(refs["image"], "src", image_src(url, refs["thumb"])):
+                dirty.append(refs["image"])
+        update_mounted(page, *dirty)
+
+    images_ready = Throttle(refresh_images, IMAGE_REFRESH_MS)
+
+    @METRICS.timed("render_products")
+    def render_products(list_of_products, keep_position=False):
+        nonlocal virtual_list, virtual_layout, shown_products
+        shown_products = list_of_products
+        layout = active_layout()
+        if not VIRTUAL_LIST:
+            products_listview.controls.clear()
+            for p in list_of_products:
+                products_listview.controls.append(
+                    build_product_card(p, layout))
+            METRICS.gauge("controls.products_list", len(products_listview.controls))
+            page.update()
+            return
+
+        viewport_h = max(400, page_height() - 220)
+        if virtual_list is None:
+            virtual_list = VirtualProductList(
+                products_listview,
+                lambda p: build_product_card(p, layout),
+                bind_product_card,
+                layout.item_height,
+                viewport_h,
+                prefetch=prefetch_images,
+            )
+            products_listview.on_scroll = virtual_list.on_scroll
+        if virtual_layout is not layout:
+            virtual_list.reset_pool(layout.item_height)
+            virtual_list.build_card = lambda p: build_product_card(p, layout)
+            virtual_layout = layout
+        # the list needs a bounded height to scroll (and report scroll events) on its own
+        resized = set_if_changed(products_listview, "height", viewport_h)
+        virtual_list.viewport_height = viewport_h
+        changed = virtual_list.set_items(list_of_products, keep_position)
+        METRICS.gauge("controls.products_list", len(products_listview.controls))
+        if changed or resized:
+            # e.g. a streamed-in chunk below a full window changes nothing on screen
+            update_mounted(page, products_listview)
+
+    @METRICS.timed("apply_resize")
+    def apply_resize(width, height):
+        nonlocal current_layout
+        layout = layout_for(width)
+        if layout is not current_layout:
+            # crossed a breakpoint: cards switch between stacked and side-by-side
+            current_layout = layout
+            render_products(shown_products, keep_position=True)
+            return
+        # same breakpoint: ResponsiveRow reflows client-side, only the list's height may change
+        if VIRTUAL_LIST and virtual_list is not None:
+            viewport_h = max(400, height - 220)
+            if set_if_changed(products_listview, "height", viewport_h):
+                # a taller viewport may need a few more cards in the window
+                virtual_list.viewport_height = viewport_h
+                virtual_list.set_items(virtual_list.items, keep_position=True)
+                update_mounted(page, products_listview)
+
+    # ---------- Views ----------
+    # Each page is built on its first visit and kept: navigating back only swaps it in.
+    # Their handlers keep updating them while hidden (update_mounted skips the sends).
+    views = {}
+
+    def show_view(name, build, refresh=None):
+        view = views.get(name)
+        if view is None:
+            view = views[name] = build()
+        main_content.controls[:] = [view]
+        if refresh is not None:
+            refresh()
         page.update()
 
     def render_home():
-        main_content.controls.clear()
-        main_content.controls.append(build_responsive_layout())
-        page.update()
+        show_view("home", build_responsive_layout)
 
-    def render_order_review():
-        main_content.controls.clear()
-        main_content.controls.append(ft.Column([
+    def build_order_review():
+        sort = ft.Dropdown(value="Newest first", width=200,
+                           options=[ft.dropdown.Option(k) for k in ORDER_SORTS],
+                           on_change=lambda e: show_orders())
+        rows = ft.Column(spacing=4)
+        history.update(
+            sort=sort,
+            # placed orders never change, so a row shown again is reused as is
+            rows=KeyedList(rows, key=lambda order: order["id"], build=build_order_row,
+                           patch=lambda row, order: False,
+                           empty=ft.Text("No orders yet", italic=True)),
+            label=ft.Text("", color=COLORS.GREY),
+            prev=ft.IconButton(ft.Icons.CHEVRON_LEFT, tooltip="Previous page", disabled=True,
+                               on_click=lambda e: on_order_page(-1)),
+            next=ft.IconButton(ft.Icons.CHEVRON_RIGHT, tooltip="Next page", disabled=True,
+                               on_click=lambda e: on_order_page(+1)))
+        return ft.Column([
             ft.Text("Order Review", weight=ft.FontWeight.BOLD, size=24),
             ft.Divider(),
             ft.Text("Here you can review all your orders."),
-            # optional: add a table of current cart or past orders
+            ft.Row([ft.Text("Past orders", weight=ft.FontWeight.BOLD), sort],
+                   alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+            ft.Row([ft.Text(h, weight=ft.FontWeight.BOLD, width=w) for h, w in order_widths]
+                   + [ft.Text("Products", weight=ft.FontWeight.BOLD, expand=True)]),
+            rows,
+            ft.Row([history["prev"], history["label"], history["next"]]),
+            ft.Divider(),
+            ft.Text("Current cart", weight=ft.FontWeight.BOLD),
             cart_listview
-        ], spacing=8))
-        page.update()
+        ], spacing=8)
 
-    def render_contact():
-        main_content.controls.clear()
-        main_content.controls.append(ft.Column([
+    def render_order_review():
+        # back to the first page each visit: orders may have been placed since
+        show_view("order_review", build_order_review, refresh=show_orders)
+
+    def build_contact():
+        return ft.Column([
             ft.Text("Contact Us", weight=ft.FontWeight.BOLD, size=24),
             ft.Divider(),
             ft.Text("Email: support@example.com"),
@@ -301,21 +3135,63 @@ def main(page: ft.Page):
             ft.Text("Address: 123 Main St, City, Country"),
             ft.TextField(label="Your Message", multiline=True, min_lines=3),
             ft.ElevatedButton(
-                "Send", on_click=lambda e: page.snack_bar.show_message("Message sent!"))
-        ], spacing=8))
-        page.update()
+                "Send", on_click=lambda e: notify("Message sent!"))
+        ], spacing=8)
 
-    def render_about():
-        main_content.controls.clear()
-        main_content.controls.append(ft.Column([
+    def render_contact():
+        show_view("contact", build_contact)
+
+    def build_about():
+        return ft.Column([
             ft.Text("About Us", weight=ft.FontWeight.BOLD, size=24),
             ft.Divider(),
             ft.Text("EMA-John is a demo e-commerce platform built using Flet."),
             ft.Text(
                 "We aim to provide a fully responsive and interactive shopping experience."),
-        ], spacing=8))
+        ], spacing=8)
+
+    def render_about():
+        show_view("about", build_about)
+
+    def render_diagnostics(e=None):
+        # not in the navbar: Ctrl+Shift+D opens it
+        snap = METRICS.snapshot()
+        header = ft.Row([ft.Text(h, weight=ft.FontWeight.BOLD, width=w) for h, w in
+                         (("", 220), ("count", 70), ("p50", 70), ("p95", 70), ("p99", 70), ("max", 80))])
+
+        def table(title, rows, unit):
+            lines = [ft.Text(title, weight=ft.FontWeight.BOLD, size=16), header]
+            for name, h in rows.items():
+                lines.append(ft.Row([ft.Text(name, width=220)] + [
+                    ft.Text(f"{h[k]:g}{unit if k != 'count' else ''}", width=w)
+                    for k, w in (("count", 70), ("p50", 70), ("p95", 70), ("p99", 70), ("max", 80))]))
+            return lines
+
+        body = [
+            ft.Row([ft.Text("Diagnostics", weight=ft.FontWeight.BOLD, size=24),
+                    ft.TextButton("Refresh", on_click=render_diagnostics)],
+                   alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+            ft.Divider(),
+        ]
+        if not snap["enabled"]:
+            body.append(ft.Text("Instrumentation is off: start with EMA_JOHN_METRICS=1.", italic=True))
+        body += table("Timings", snap["timings_ms"], " ms")
+        body += table("Sizes", snap["sizes"], "")
+        body.append(ft.Text("Gauges", weight=ft.FontWeight.BOLD, size=16))
+        body += [ft.Text(f"{k}: {v}") for k, v in sorted(snap["gauges"].items())]
+        body.append(ft.Text(f"search.pipeline (this session): {search_pipeline.stats()}"))
+        body += [ft.Divider(), ft.Text("JSON", weight=ft.FontWeight.BOLD, size=16),
+                 ft.Text(json.dumps(snap, indent=1), selectable=True, size=11, font_family="monospace")]
+        main_content.controls.clear()
+        main_content.controls.append(ft.Column(body, spacing=6))
         page.update()
 
+    def on_keyboard(e):
+        if e.ctrl and e.shift and (e.key or "").upper() == "D":
+            render_diagnostics()
+
+    page.on_keyboard_event = on_keyboard
+
     # Top area
     """
     top_area = ft.Column([
@@ -337,7 +3213,7 @@ def main(page: ft.Page):
                         content=ft.Image(
                             src="./logo.png",
                             expand=True,
-                            fit=ft.ImageFit.CONTAIN,
+                            fit=FIT_CONTAIN,
                         ),
                         col={"md": 4, "sm": 12},
                         padding=10,
@@ -415,16 +3291,81 @@ def main(page: ft.Page):
         ]
     )
 
+    # ---------- Facet filters ----------
+    facet_selection = {facet: set() for facet in FACETS}
+
+    def current_selection():
+        return {facet: frozenset(values) for facet, values in facet_selection.items() if values}
+
+    def query_active():
+        return bool((search_input.value or "").strip() or any(facet_selection.values())
+                    or (sort_dropdown.value or "Relevance") != "Relevance")
+
+    def on_facet_toggle(e):
+        facet, value = e.control.data
+        if e.control.value:
+            facet_selection[facet].add(value)
+        else:
+            facet_selection[facet].discard(value)
+        on_sort_change()
+
+    def facet_option_state(item):
+        facet, value, count = item
+        selected = value in facet_selection[facet]
+        return f"{value} ({count})", selected, count == 0 and not selected
+
+    def build_facet_option(item):
+        label, selected, disabled = facet_option_state(item)
+        return ft.Checkbox(label=label, value=selected, disabled=disabled,
+                           data=item[:2], on_change=on_facet_toggle)
+
+    def patch_facet_option(checkbox, item):
+        changed = False
+        for attr, value in zip(("label", "value", "disabled"), facet_option_state(item)):
+            changed = set_if_changed(checkbox, attr, value) or changed
+        return changed
+
+    facet_columns = {facet: ft.Column(spacing=0, tight=True) for facet in FACETS}
+    facet_lists = {facet: KeyedList(facet_columns[facet], key=lambda item: item[1],
+                                    build=build_facet_option, patch=patch_facet_option)
+                   for facet in FACETS}
+    facets_panel = ft.ResponsiveRow([
+        ft.Column([ft.Text(FACET_TITLES[facet], weight=ft.FontWeight.BOLD, size=13),
+                   facet_columns[facet]], spacing=2, col={"sm": 6, "md": 4, "xl": 2})
+        for facet in FACETS
+    ], spacing=12, run_spacing=6)
+
+    def render_facets(counts):
+        dirty = []
+        for facet, keyed in facet_lists.items():
+            values = counts[facet]
+            if len(values) > FACET_MAX_VALUES:
+                top = sorted(values, key=values.__getitem__, reverse=True)[:FACET_MAX_VALUES]
+                shown = set(top) | facet_selection[facet]
+                values = {v: n for v, n in values.items() if v in shown}
+            dirty.extend(keyed.reconcile([(facet, v, n) for v, n in values.items()]))
+        update_mounted(page, *dirty)
+
+    def refresh_facets():
+        with catalog_lock:
+            counts = catalog_engine.facet_counts((search_input.value or "").strip(), current_selection())
+        render_facets(counts)
+
     # Build ResponsiveRow layout (products | cart)
     def build_responsive_layout():
-        # populate product column
-        render_products(products)
-        refresh_cart_ui()
+        # populate product column with whatever the search box / facets currently ask for
+        render_results(filter_and_sort((search_input.value or "").strip(),
+                                       sort_dropdown.value or "Relevance", current_selection()),
+                       keep_position=False)
+        refresh_cart_ui(full=True)
 
         products_column.controls.clear()
+        product_count_txt.value = f"{len(catalog_engine)} items"
         products_column.controls.append(ft.Row([ft.Text("Products", weight=ft.FontWeight.BOLD),
-                                                ft.Text(f"{len(products)} items", color=COLORS.GREY)],))
+                                                product_count_txt],))
+        products_column.controls.append(facets_panel)
         products_column.controls.append(ft.Divider())
+        products_column.controls.append(loading_row)
         products_column.controls.append(products_listview)
 
         cart_column.controls.clear()
@@ -437,7 +3378,7 @@ def main(page: ft.Page):
         cart_column.controls.append(shipping_txt)
         cart_column.controls.append(total_txt)
         cart_column.controls.append(ft.ElevatedButton(
-            "Checkout", on_click=lambda e: None, expand=True))
+            "Checkout", on_click=checkout, expand=True))
 
         rr = ft.ResponsiveRow([
             ft.Container(products_column, padding=12, col={
@@ -448,45 +3389,210 @@ def main(page: ft.Page):
         return rr
 
     # Search / sort handlers
+    catalog_engine = snapshot.engine.fork() if SERVER_MODE else FilterSortEngine(products, search_index)
+
+    # a background refresh patches the catalog while searches read it
+    catalog_lock = threading.RLock()
+
+    shown_query = None  # (query, sort, selection) of the results on screen
+
+    @METRICS.timed("search.query")
+    def filter_and_sort(q, sort_val, selection=None):
+        with catalog_lock:
+            found = catalog_engine.query(q, sort_val, selection)
+            counts = catalog_engine.facet_counts(q, selection)
+        return (q, sort_val, selection), found, counts
+
+    def render_results(result, keep_position=None):
+        nonlocal shown_query
+        query, found, counts = result
+        if keep_position is None:
+            # the same query again (after a refresh or once loading ends) keeps the scroll position
+            keep_position = query == shown_query
+        render_products(found, keep_position=keep_position)
+        shown_query = query
+        render_facets(counts)
+
+    # keystrokes are debounced; stale results never reach products_listview
+    search_pipeline = SearchPipeline(filter_and_sort, render_results)
+
+    @METRICS.timed("on_search_or_sort")
     def on_search_or_sort(e=None):
-        q = search_input.value.strip().lower()
-        filtered = [p for p in products if (q in p["name"].lower() or q in p.get(
-            "category", "").lower())] if q else products.copy()
-        sort_val = sort_dropdown.value or "Relevance"
-        if sort_val == "Price: Low → High":
-            filtered.sort(key=lambda x: x["price"])
-        elif sort_val == "Price: High → Low":
-            filtered.sort(key=lambda x: -x["price"])
-        elif sort_val == "Top Rated":
-            filtered.sort(
-                key=lambda x: (-x.get("ratings", 0), -x.get("ratingsCount", 0)))
-        # render filtered list
-        products_listview.controls.clear()
-        for p in filtered:
-            products_listview.controls.append(build_product_card(
-                p, compute_img_size(int(getattr(page, "window_width", page.width or 1000)))))
-        page.update()
+        search_pipeline.submit((search_input.value or "").strip(),
+                               sort_dropdown.value or "Relevance", current_selection())
+
+    def on_sort_change(e=None):
+        # a dropdown pick or facet tick is a single deliberate event: no need to wait
+        search_pipeline.submit((search_input.value or "").strip(),
+                               sort_dropdown.value or "Relevance", current_selection(), delay_ms=0)
 
     search_input.on_change = on_search_or_sort
-    sort_dropdown.on_change = on_search_or_sort
+    sort_dropdown.on_change = on_sort_change
+
+    def catalog_changed():
+        # after a refresh: carry the cart over, then redraw in place (scroll position kept)
+        removed, clamped = cart.reconcile(catalog_engine.get)
+        refresh_cart_ui()
+        if removed or clamped:
+            notify(f"Your cart was updated: {len(removed)} item(s) no longer available, "
+                   f"{len(clamped)} reduced to the stock left")
+        set_if_changed(product_count_txt, "value", f"{len(catalog_engine)} items")
+        update_mounted(page, product_count_txt)
+        # re-run the query through the pipeline, so a search still in flight for the old
+        # catalog is dropped instead of rendering products that are gone
+        on_sort_change()
+
+    def apply_catalog(new_products):
+        # swap in a freshly fetched catalog; the caller holds catalog_lock and redraws after
+        nonlocal products, search_index
+        products = ProductStore(new_products)
+        search_index = SearchIndex(products)
+        catalog_engine.index = search_index
+        catalog_engine.rebuild(products)
+
+    @METRICS.timed("catalog.refresh")
+    def apply_refresh(new_products):
+        # periodic refresh: patch only what changed into the store, indexes and cards
+        new_products = list(new_products)
+        with catalog_lock:
+            delta = diff_catalog(products, new_products)
+            if not any(delta):
+                return
+            if sum(map(len, delta)) > DELTA_REBUILD_FRACTION * max(1, len(catalog_engine)):
+                apply_catalog(new_products)
+            else:
+                apply_delta(delta)
+        catalog_changed()
+
+    def apply_delta(delta):
+        # the caller holds catalog_lock
+        for pid in delta.removed:
+            products.discard(pid)
+            search_index.remove(pid)
+        changed = []
+        for p, fields in delta.changed:
+            i = products.index_of(p["id"])
+            for field in fields:
+                products.set(i, field, p[field])
+            row = products[i]
+            if any(field in dict(SEARCH_FIELDS) for field in fields):
+                search_index.update(row)
+            changed.append((row, fields))
+        start = len(products)
+        for p in delta.added:
+            products.append(p)
+        added = products[start:]
+        search_index.extend(added)
+        catalog_engine.apply_delta(added, delta.removed, changed)
+
+    def on_catalog_replaced(snapshot, delta=None):
+        # server mode: a refresh published a new shared catalog
+        nonlocal products, search_index, catalog_engine
+        with catalog_lock:
+            products, search_index = snapshot.products, snapshot.index
+            catalog_engine = snapshot.engine.fork()
+        catalog_changed()
+
+    def append_products(chunk):
+        # searches run on the pipeline's timer threads: they must not see a half-added chunk
+        with catalog_lock:
+            start = len(products)
+            for p in chunk:
+                products.append(p)
+            rows = products[start:]
+            search_index.extend(rows)
+            catalog_engine.extend(rows)
+        product_count_txt.value = f"{len(products)} items"
+        # while a query is showing it's re-run once loading finishes
+        if not query_active():
+            render_products(products, keep_position=True)
+        update_mounted(page, product_count_txt)
+
+    @METRICS.timed("catalog.load")
+    async def load_catalog_progressively():
+        loading_row.visible = True
+        page.update()
+        # the cache is read a chunk at a time too, so the first cards don't wait for all of it
+        from_cache = False
+        if catalog_cache:
+            chunks = catalog_cache.iter_chunks()
+            try:
+                while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                    append_products(chunk)
+                    from_cache = True
+            except Exception as e:
+                if not from_cache:
+                    print("Warning: failed to read catalog cache:", e)
+        if not from_cache:
+            async for chunk in stream_catalog(CATALOG_SOURCE, cache=catalog_cache):
+                append_products(chunk)
+        loading_row.visible = False
+        if query_active():
+            on_sort_change()
+        else:
+            refresh_facets()
+            page.update()
+        refresher.start(immediately=from_cache)
 
     # Page layout builder
     # Page layout builder - do NOT add build_responsive_layout() here
 
+    @METRICS.timed("layout_builder")
     def layout_builder(e=None):
         page.controls.clear()
         page.add(top_area)
         page.add(main_content)
         page.update()
 
-    # Ensure on_resize keeps layout but doesn't re-add product layout itself
-    page.on_resize = layout_builder
+    # Resize events come in bursts while the window is dragged: throttle them and
+    # only rebuild card layouts when the breakpoint actually changes
+    resize_throttle = Throttle(apply_resize, RESIZE_THROTTLE_MS)
+
+    def on_resize(e=None):
+        if getattr(e, "width", None):
+            window_size.update(width=e.width, height=e.height)
+        resize_throttle(page_width(), page_height())
+
+    page.on_resized = on_resize
 
     # Initial render: build layout first, then populate home
     layout_builder()
     render_home()
-    refresh_cart_ui()
+    refresh_cart_ui(full=True)
+
+    # keeps prices and stock current; in server mode the shared catalog refreshes itself
+    refresher = CatalogRefresher(apply_refresh, cache=catalog_cache)
+
+    def on_close(e=None):
+        OPEN_PAGES.discard(page)
+        search_pipeline.cancel()
+        refresher.stop()
+        if SERVER_MODE:
+            shared.unsubscribe(on_catalog_replaced)
+            if image_cache is not None:
+                image_cache.unsubscribe(on_image_ready)
+            return
+        if image_cache is not None:
+            image_cache.close()
+        if orders is not None:
+            orders.close()
+
+    page.on_close = on_close
+
+    if SERVER_MODE:
+        shared.subscribe(on_catalog_replaced)
+    elif ASYNC_CATALOG_LOAD:
+        page.run_task(load_catalog_progressively)
+    else:
+        refresher.start(immediately=cached is not None)
 
 
 if __name__ == "__main__":
-    ft.app(target=main)
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
+    if SERVER_MODE:
+        shared_catalog().get()  # loaded before the first session connects
+        shared_catalog().start_refreshing()
+        ft.app(target=main, view=ft.AppView.WEB_BROWSER, port=SERVER_PORT, assets_dir=ASSETS_DIR)
+    else:
+        ft.app(target=main)